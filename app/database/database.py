@@ -1,18 +1,130 @@
-from sqlalchemy import create_engine
+import functools
+import inspect
+from fastapi.routing import APIRoute
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from models import codec
+import settings
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./moscow_urban_analysis_final.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./moscow_urban_analysis_final.db"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# Connection profiles selected with settings.DB_PROFILE. Connections are pooled
+# (SQLAlchemy 1.4 defaults to a new connection per checkout for SQLite files), so
+# the PRAGMAs below run once per connection and each keeps its cache of prepared
+# statements (``cached_statements``) across requests.
+DB_PROFILES = {
+    # Many concurrent readers: large page cache and memory map, more connections
+    "read": {
+        "pool_size": 8,
+        "cached_statements": 256,
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64 * 1024,
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000,
+        },
+    },
+    # Frequent writes: fewer connections contending for the write lock, and WAL
+    # checkpoints in larger, rarer batches
+    "write": {
+        "pool_size": 2,
+        "cached_statements": 128,
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 64 * 1024 * 1024,
+            "cache_size": -16 * 1024,
+            "temp_store": "MEMORY",
+            "busy_timeout": 10000,
+            "wal_autocheckpoint": 10000,
+        },
+    },
+}
+db_profile = DB_PROFILES[settings.DB_PROFILE]
+
+# pool_size connections stay open; the rest, up to the threadpool size (AnyIO's
+# 40, above the 32 loop executor maximum), are opened on demand and closed on
+# return, so a sync handler does not wait on checkout behind other requests
+MAX_CONNECTIONS = 40
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False, "cached_statements": db_profile["cached_statements"]},
+    poolclass=QueuePool,
+    pool_size=db_profile["pool_size"],
+    max_overflow=MAX_CONNECTIONS - db_profile["pool_size"],
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Same database for the async endpoints; objects stay readable after commit
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args={"cached_statements": db_profile["cached_statements"]},
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=db_profile["pool_size"],
+    max_overflow=MAX_CONNECTIONS - db_profile["pool_size"],
+)
+AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-# Dependency
-def get_db():
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def configure_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in db_profile["pragmas"].items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+    # Lets SQL read the packed neighbour_ids column, e.g. through json_each(ids_json(...))
+    dbapi_connection.create_function("ids_json", 1, codec.ids_to_text, deterministic=True)
+
+# Dependency. Async, so the session is closed on the event loop once the response
+# is sent: a sync generator dependency is closed on the threadpool, which may be
+# busy with requests waiting for the very connections it would give back. Routers
+# using it set route_class=SessionRoute (or a subclass, e.g. ProfiledRoute).
+async def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def closing_sessions(endpoint):
+    """Sync endpoint that closes its Session arguments as soon as it returns.
+
+    FastAPI validates a sync endpoint's response_model on the threadpool and
+    closes its dependencies only after the response is sent, so without this
+    a finished request keeps its pooled connection while waiting for a worker,
+    and once the workers are all waiting on checkout nothing moves. Returned
+    ORM objects stay readable detached, as every handler loads them first.
+    """
+    if inspect.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            for value in kwargs.values():
+                if isinstance(value, Session):
+                    value.close()
+    return wrapper
+
+
+class SessionRoute(APIRoute):
+    """APIRoute whose sync endpoint gives its database session back as soon as it returns (see closing_sessions)."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, closing_sessions(endpoint), **kwargs)
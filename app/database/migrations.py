@@ -0,0 +1,115 @@
+from sqlalchemy import inspect
+from models import codec
+
+# Schema changes to an existing database are numbered migrations. The number of
+# the last one applied is kept in PRAGMA user_version; ``migrate`` runs the rest
+# in order, each in its own transaction. Append new steps to MIGRATIONS, never
+# reorder or edit applied ones. A step returns False when it had nothing to do.
+
+# Text column -> (packed column, packer); see models.codec for the layout
+PACKED_COLUMNS = {
+    "peaks_json": ("peaks", codec.peaks_from_text),
+    "roads_list_json": ("road_ids", codec.road_ids_from_text),
+    "neighbours": ("neighbour_ids", codec.ids_from_text),
+}
+
+
+def _columns(connection):
+    inspector = inspect(connection)
+    if "hexagonal_data" not in inspector.get_table_names():
+        return None
+    return inspector.get_columns("hexagonal_data")
+
+
+def migrate_binary_columns(connection):
+    """1: replace the JSON text columns of hexagonal_data by packed BLOB columns."""
+    columns = _columns(connection)
+    existing = {column["name"] for column in columns or []}
+    if not set(PACKED_COLUMNS) & existing:
+        return False
+
+    for text_column, (blob_column, _) in PACKED_COLUMNS.items():
+        if blob_column not in existing:
+            connection.exec_driver_sql(f"ALTER TABLE hexagonal_data ADD COLUMN {blob_column} BLOB")
+    rows = connection.exec_driver_sql(
+        f"SELECT rowid, {', '.join(PACKED_COLUMNS)} FROM hexagonal_data"
+    ).all()
+    assignments = ", ".join(f"{blob_column} = ?" for blob_column, _ in PACKED_COLUMNS.values())
+    connection.exec_driver_sql(
+        f"UPDATE hexagonal_data SET {assignments} WHERE rowid = ?",
+        [
+            tuple(pack(text) for text, (_, pack) in zip(row[1:], PACKED_COLUMNS.values())) + (row[0],)
+            for row in rows
+        ],
+    )
+    for text_column in PACKED_COLUMNS:
+        connection.exec_driver_sql(f"ALTER TABLE hexagonal_data DROP COLUMN {text_column}")
+    return True
+
+
+def migrate_integer_key(connection):
+    """2: rebuild hexagonal_data keyed by INTEGER hex_id, with an index on the centre.
+
+    The shipped table has a TEXT hex_id with neither key nor index, so lookups
+    were full scans comparing text to the integer path parameter. As INTEGER
+    PRIMARY KEY, hex_id becomes the rowid: lookups and hex_id ordering use the
+    table b-tree itself and new rows get the next free id.
+    """
+    columns = _columns(connection)
+    if columns is None:
+        return False
+    hex_id = next(column for column in columns if column["name"] == "hex_id")
+    if hex_id["primary_key"] and str(hex_id["type"]) == "INTEGER":
+        return False
+
+    others = [column for column in columns if column["name"] != "hex_id"]
+    definitions = ", ".join(f'"{column["name"]}" {column["type"]}' for column in others)
+    names = ", ".join(f'"{column["name"]}"' for column in others)
+    connection.exec_driver_sql(
+        f'CREATE TABLE hexagonal_data_new ("hex_id" INTEGER NOT NULL PRIMARY KEY, {definitions})'
+    )
+    connection.exec_driver_sql(
+        f'INSERT INTO hexagonal_data_new ("hex_id", {names}) '
+        f'SELECT CAST("hex_id" AS INTEGER), {names} FROM hexagonal_data'
+    )
+    connection.exec_driver_sql("DROP TABLE hexagonal_data")
+    connection.exec_driver_sql("ALTER TABLE hexagonal_data_new RENAME TO hexagonal_data")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_hexagonal_data_center ON hexagonal_data (center_lon, center_lat)"
+    )
+    return True
+
+
+MIGRATIONS = [
+    migrate_binary_columns,
+    migrate_integer_key,
+]
+
+
+def schema_version(connection):
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(engine):
+    """Bring an existing database up to the current schema; returns the steps applied."""
+    applied = []
+    with engine.connect() as connection:
+        version = schema_version(connection)
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        with engine.begin() as connection:
+            # pysqlite leaves DDL in autocommit unless a transaction is opened explicitly
+            connection.exec_driver_sql("BEGIN")
+            if step(connection):
+                applied.append(number)
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+    if applied:
+        # Give back the pages freed by the rebuilt or dropped columns
+        with engine.connect() as connection:
+            connection.exec_driver_sql("VACUUM")
+    return applied
+
+
+if __name__ == "__main__":
+    from database.database import engine
+    applied = migrate(engine)
+    print(f"applied {', '.join(map(str, applied))}" if applied else "up to date")
@@ -1,9 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routes import hexagons
-from database.database import engine, Base
+import settings
+from routes import admin, hexagons, hexagons_async, internal
+from database.database import async_engine, engine, Base, SessionLocal
+from database.migrations import migrate
+from services.conditional import ConditionalMiddleware
+from services.hexagon_store import hexagon_store
+from services.instrumentation import InstrumentationMiddleware, instrument_engine
+from services.profiling import ProfilingMiddleware
+from services.rating_cache import rating_cache
+from services.snapshot import SnapshotMiddleware, snapshot_source
+from services.spatial import get_hexagon_index
 
-# Create database tables
+# Upgrade an existing database, then create any missing tables
+migrate(engine)
 Base.metadata.create_all(bind=engine)
 
 # Create the FastAPI app instance
@@ -13,6 +23,10 @@ app = FastAPI(
     version="0.2.0"
 )
 
+# ETag / Last-Modified on reads, 304 when unchanged; innermost, so CORS headers, metrics and the
+# snapshot refresh apply to 304s too
+app.add_middleware(ConditionalMiddleware, store=hexagon_store)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -20,11 +34,57 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-DB-Queries", "X-DB-Time-Ms", "ETag"],
 )
 
+# Per-route latency and per-request SQL counts, served at /metrics/internal
+app.add_middleware(InstrumentationMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+# Opt-in request profiling; nothing is added to the request path unless a token is configured
+if settings.PROFILING_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+
+# Multi-worker mode: keep this worker on the latest shared snapshot, publishing its own writes
+if snapshot_source is not None:
+    app.add_middleware(SnapshotMiddleware, store=hexagon_store)
+
 # Include routers
 app.include_router(hexagons.router)
+app.include_router(hexagons_async.router if settings.DB_MODE == "async" else hexagons.sync_router)
+app.include_router(internal.router)
+app.include_router(admin.router)
+
+# Load the hexagon table into memory once; reads are served from it afterwards
+@app.on_event("startup")
+def load_hexagon_store():
+    if snapshot_source is not None:
+        # Mapped from the shared snapshot, rating engine and spatial index included; the
+        # rating cache is private to each worker, so it is filled on demand instead of warmed
+        snapshot_source.load(hexagon_store)
+        return
+    db = SessionLocal()
+    try:
+        hexagon_store.load(db)
+    finally:
+        db.close()
+    rating_cache.warm(hexagon_store)
+    get_hexagon_index(hexagon_store)
+
+# Pooled connections are kept open; aiosqlite's would otherwise block interpreter exit
+@app.on_event("shutdown")
+async def close_connections():
+    await async_engine.dispose()
+    engine.dispose()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if settings.WORKERS > 1:
+        if snapshot_source is None:
+            raise SystemExit("WORKERS > 1 needs SNAPSHOT_DIR for the shared dataset snapshot")
+        # Build the snapshot once here; the workers only map it
+        snapshot_source.rebuild()
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=settings.WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
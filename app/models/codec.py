@@ -0,0 +1,87 @@
+import json
+import numpy as np
+
+# Binary layout of the packed hexagonal_data columns (all little-endian):
+#   peaks          float64 [lon0, lat0, lon1, lat1, ...]
+#   neighbour_ids  int32 hex_ids
+#   road_ids       int32 road ids; ids written as "i<id>" in the source data are stored negated
+# float64 keeps peaks bit-exact, so the JSON produced at the API edge matches the original text.
+PEAK_DTYPE = np.dtype("<f8")
+ID_DTYPE = np.dtype("<i4")
+
+
+def pack_peaks(peaks):
+    return np.asarray(peaks, dtype=PEAK_DTYPE).reshape(-1, 2).tobytes()
+
+
+def unpack_peaks(blob):
+    """(n, 2) lon/lat view over the blob, without copying."""
+    return np.frombuffer(blob, dtype=PEAK_DTYPE).reshape(-1, 2)
+
+
+def pack_ids(ids):
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) and (ids.min() < np.iinfo(ID_DTYPE).min or ids.max() > np.iinfo(ID_DTYPE).max):
+        raise ValueError("id does not fit in int32")
+    return ids.astype(ID_DTYPE).tobytes()
+
+
+def unpack_ids(blob):
+    return np.frombuffer(blob, dtype=ID_DTYPE)
+
+
+def pack_road_ids(roads):
+    ids = []
+    for road in roads:
+        road = str(road)
+        if road.startswith("i"):
+            if not road[1:].isdigit() or int(road[1:]) == 0:
+                raise ValueError(f"Unsupported road id '{road}'")
+            ids.append(-int(road[1:]))
+        elif road.isdigit():
+            ids.append(int(road))
+        else:
+            raise ValueError(f"Unsupported road id '{road}'")
+    return pack_ids(ids)
+
+
+def unpack_road_ids(blob):
+    return unpack_ids(blob)
+
+
+def peaks_to_json(peaks):
+    return json.dumps(peaks.tolist())
+
+
+def ids_to_json(ids):
+    return json.dumps(ids.tolist())
+
+
+def road_ids_to_json(ids):
+    return json.dumps([str(road) if road >= 0 else f"i{-road}" for road in ids.tolist()])
+
+
+# Text <-> blob conversions used where the API still speaks JSON strings
+
+def peaks_from_text(text):
+    return None if text is None else pack_peaks(json.loads(text))
+
+
+def peaks_to_text(blob):
+    return None if blob is None else peaks_to_json(unpack_peaks(blob))
+
+
+def ids_from_text(text):
+    return None if text is None else pack_ids(json.loads(text))
+
+
+def ids_to_text(blob):
+    return None if blob is None else ids_to_json(unpack_ids(blob))
+
+
+def road_ids_from_text(text):
+    return None if text is None else pack_road_ids(json.loads(text))
+
+
+def road_ids_to_text(blob):
+    return None if blob is None else road_ids_to_json(unpack_road_ids(blob))
@@ -1,10 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, Text
+from sqlalchemy import Column, Index, Integer, String, Float, LargeBinary
 from database.database import Base
+from models import codec
 
 class HexagonData(Base):
     __tablename__ = "hexagonal_data"
+    # Kept in step with database/migrations.py, which upgrades existing databases
+    __table_args__ = (Index("ix_hexagonal_data_center", "center_lon", "center_lat"),)
 
-    hex_id = Column(String, primary_key=True, index=True, nullable=True)
+    hex_id = Column(Integer, primary_key=True)
     center_lon = Column(Float, nullable=True)
     center_lat = Column(Float, nullable=True)
     avg_speed = Column(Float, nullable=True)
@@ -27,6 +30,31 @@ class HexagonData(Base):
     count_hospitals = Column(Integer, nullable=True)
     count_shops = Column(Integer, nullable=True)
     count_factories = Column(Integer, nullable=True)
-    peaks_json = Column(Text, nullable=True)
-    roads_list_json = Column(Text, nullable=True)
-    neighbours = Column(Text, nullable=True)
+    peaks = Column(LargeBinary, nullable=True)
+    road_ids = Column(LargeBinary, nullable=True)
+    neighbour_ids = Column(LargeBinary, nullable=True)
+
+    # JSON text views of the packed columns, as exposed by the API schemas
+    @property
+    def peaks_json(self):
+        return codec.peaks_to_text(self.peaks)
+
+    @peaks_json.setter
+    def peaks_json(self, value):
+        self.peaks = codec.peaks_from_text(value)
+
+    @property
+    def roads_list_json(self):
+        return codec.road_ids_to_text(self.road_ids)
+
+    @roads_list_json.setter
+    def roads_list_json(self, value):
+        self.road_ids = codec.road_ids_from_text(value)
+
+    @property
+    def neighbours(self):
+        return codec.ids_to_text(self.neighbour_ids)
+
+    @neighbours.setter
+    def neighbours(self, value):
+        self.neighbour_ids = codec.ids_from_text(value)
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from services.profiling import profile_buffer, token_valid
+
+
+def require_profiling_token(x_profile_token: Optional[str] = Header(None)):
+    if not token_valid(x_profile_token):
+        raise HTTPException(status_code=403, detail="Profiling token required")
+
+router = APIRouter(prefix="/admin", tags=["internal"], dependencies=[Depends(require_profiling_token)])
+
+@router.get("/profiles")
+def read_profiles():
+    """Recorded request profiles, oldest first, without their stacks."""
+    return profile_buffer.list()
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def read_profile(profile_id: int):
+    """Collapsed stacks of one profile (input for flamegraph.pl, speedscope, ...)."""
+    profile = profile_buffer.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile["collapsed"])
@@ -1,27 +1,292 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import numpy as np
 import schemas
+import settings
 from database.database import SessionLocal, get_db
 from models.hexagon import HexagonData
-from services.hexagon_ratings import calc_finaly_rating
+from services.hexagon_bulk import apply_to_store, bulk_create, bulk_delete, bulk_update
+from services.hexagon_ratings import (
+    calc_finaly_rating, calc_weights, load_rating_context, load_rating_contexts, weight_profiles,
+)
+from services.hexagon_export import export_ndjson
+from services.fast_json import FastJSONResponse, float_list, store_rows
+from services.grid import choose_encoding, get_grid
+from services.lod import get_lod_pyramid
+from services.hexagon_store import HexagonStore, StoreState, get_hexagon_store
+from services.profiling import ProfiledRoute
+from services.rating_cache import rating_cache
+from services.rating_engine import MAX_RINGS, get_rating_engine, top_k
+from services.single_flight import metrics_flight
+from services.spatial import get_hexagon_index
+from services.weight_profiles import canonical_flags
 
 
-router = APIRouter(prefix="/hexagons", tags=["hexagons"])
+router = APIRouter(prefix="/hexagons", tags=["hexagons"], route_class=ProfiledRoute)
+# Record endpoints over a blocking Session; routes.hexagons_async has the async
+# variants and main.py includes one of the two after ``router`` (see settings.DB_MODE)
+sync_router = APIRouter(prefix="/hexagons", tags=["hexagons"], route_class=ProfiledRoute)
 
-@router.get("/", response_model=List[schemas.Hexagon])
-def read_hexagons(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    hexagons = db.query(HexagonData).offset(skip).limit(limit).all()
-    return hexagons
-
-@router.get("/{hexagon_id}", response_model=schemas.Hexagon)
-def read_hexagon(hexagon_id: int, db: Session = Depends(get_db)):
-    hexagon = db.query(HexagonData).filter(HexagonData.hex_id == hexagon_id).first()
-    if hexagon is None:
+def get_store(db: Session = Depends(get_db)):
+    return get_hexagon_store(db)
+
+async def get_state(store: HexagonStore = Depends(get_store)):
+    """The store data as of the start of the request; reads stay on it even if a write lands meanwhile."""
+    return store.state
+
+def get_bbox(bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat")):
+    if bbox is None:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=422, detail="bbox minimum exceeds maximum")
+    return min_lon, min_lat, max_lon, max_lat
+
+def get_rings(
+    rings: int = Query(1, ge=1, le=MAX_RINGS, description="Neighbourhood rings counted in the rating"),
+    decay: float = Query(0.5, gt=0, le=1, description="Weight factor per extra ring")
+):
+    """(rings, decay); rings=1 is the direct-neighbour rating."""
+    return rings, decay
+
+def ring_rating(store, hex_id, flags, rings, decay):
+    """Rating of hex_id over several rings, None when it is not in the store."""
+    row = store.row_index(hex_id)
+    if row is None:
+        return None
+    return get_rating_engine(store).rate_row(calc_weights(*flags), row, rings, decay)
+
+def metrics_key(store, hexagon_id, flags, rings, decay):
+    """metrics_flight key of a /{hexagon_id}/metrics request, for the data and weight profiles as they are now."""
+    return (
+        hexagon_id, canonical_flags(*flags), rings, decay if rings > 1 else None,
+        store.revision, weight_profiles.version,
+    )
+
+def batch_ratings(store, hex_ids, personas, rings, decay):
+    """{hex_id: [rating per persona]} of the hex_ids found in the store."""
+    rows = {hex_id: store.row_index(hex_id) for hex_id in hex_ids}
+    rows = {hex_id: row for hex_id, row in rows.items() if row is not None}
+    if rings > 1:
+        engine = get_rating_engine(store)
+        weights = [calc_weights(*flags) for flags in personas]
+        return {hex_id: [engine.rate_row(w, row, rings, decay) for w in weights] for hex_id, row in rows.items()}
+    # One whole-grid lookup per persona instead of one cache round trip per cell
+    columns = [rating_cache.ratings(store, flags)[1] for flags in personas]
+    return {hex_id: [column[row] for column in columns] for hex_id, row in rows.items()}
+
+def context_ratings(contexts, personas):
+    """batch_ratings from rating contexts already loaded (see load_rating_contexts)."""
+    return {idx: [calc_finaly_rating(context, *flags) for flags in personas] for idx, context in contexts.items()}
+
+def metrics_matrix_response(hex_ids, ratings):
+    """schemas.MetricsMatrix for the requested hex_ids and the ratings of those that exist."""
+    return FastJSONResponse({
+        "hex_ids": hex_ids,
+        "ratings": [float_list(ratings[hex_id]) if hex_id in ratings else None for hex_id in hex_ids],
+    })
+
+def get_projection(
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    view: Optional[str] = Query(None, regex="^(summary|geometry|full)$")
+):
+    """Columns requested through fields= or view=, None for the full row."""
+    if fields is not None and view is not None:
+        raise HTTPException(status_code=422, detail="Use either fields or view")
+    if fields is not None:
+        names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+        unknown = [name for name in names if name not in schemas.HEXAGON_VIEWS["full"]]
+        if unknown:
+            raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+        return names
+    if view is not None and view != "full":
+        return schemas.HEXAGON_VIEWS[view]
+    return None
+
+def hexagons_response(store, rows, fields=None, headers=None):
+    """Store rows rendered straight to JSON, shaped as schemas.Hexagon or the fields projection.
+
+    Rows come from the store, so they are not validated again one model at a
+    time; response_model on the routes only documents the shape.
+    """
+    return FastJSONResponse(store_rows(store, rows, fields), headers=headers)
+
+def hexagon_response(store, hexagon_id, fields=None):
+    row = store.row_index(hexagon_id)
+    if row is None:
         raise HTTPException(status_code=404, detail="Hexagon data not found")
-    return hexagon
+    return FastJSONResponse(store_rows(store, [row], fields)[0])
+
+def ratings_response(hex_ids, ratings):
+    """schemas.HexagonRatings for parallel hex_id and rating arrays."""
+    return FastJSONResponse({"ratings": dict(zip(hex_ids.tolist(), float_list(ratings)))})
+
+@router.get("/", response_model=List[schemas.Hexagon])
+def read_hexagons(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[int] = Query(None, description="Keyset cursor: return hexagons with hex_id > after"),
+    fields: Optional[tuple] = Depends(get_projection),
+    store: StoreState = Depends(get_state)
+):
+    if after is None:
+        rows = store.page_rows(skip, limit)
+    else:
+        rows = store.page_after_rows(after, limit)
+        if len(rows) and len(rows) == limit:
+            # Cursor for the next keyset page. Offset pages follow row order, which
+            # writes do not keep sorted by hex_id, so they get none
+            response.headers["X-Next-Cursor"] = str(int(store.hex_ids[rows[-1]]))
+    return hexagons_response(store, rows, fields, response.headers)
 
-@router.get("/{hexagon_id}/metrics")
+@router.get("/export")
+def export_hexagons(after: Optional[int] = None, fields: Optional[tuple] = Depends(get_projection)):
+    return StreamingResponse(export_ndjson(after, fields), media_type="application/x-ndjson")
+
+@router.get("/grid")
+def read_grid(
+    format: str = Query("geojson", regex="^(geojson|binary)$"),
+    accept_encoding: Optional[str] = Header(None),
+    store: StoreState = Depends(get_state)
+):
+    """Every hexagon polygon with its scalar columns, as GeoJSON or the compact binary layout (see services.grid)."""
+    grid = get_grid(store, format)
+    encoding = choose_encoding(accept_encoding)
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(grid.body(encoding), media_type=grid.media_type, headers=headers)
+
+@router.get("/ratings", response_model=schemas.HexagonRatings)
+def read_hexagon_ratings(
+    flags: schemas.PersonaFlags = Depends(),
+    ring: tuple = Depends(get_rings),
+    store: StoreState = Depends(get_state)
+):
+    rings, decay = ring
+    if rings > 1:
+        engine = get_rating_engine(store)
+        return ratings_response(engine.hex_ids, engine.rate_flags(*flags.dict().values(), rings=rings, decay=decay))
+    return ratings_response(*rating_cache.ratings(store, tuple(flags.dict().values())))
+
+@router.post("/ratings", response_model=schemas.HexagonRatings)
+def rate_hexagons(
+    weight_vector: schemas.WeightVector,
+    ring: tuple = Depends(get_rings),
+    store: StoreState = Depends(get_state)
+):
+    base = None
+    if weight_vector.base is not None:
+        base = weight_profiles.profiles.get(weight_vector.base)
+        if base is None:
+            raise HTTPException(status_code=404, detail="Weight profile not found")
+    try:
+        weights = weight_profiles.vector(weight_vector.weights, base=base)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    engine = get_rating_engine(store)
+    return ratings_response(engine.hex_ids, engine.rate(weights, *ring))
+
+@router.get("/top", response_model=schemas.TopHexagons)
+def read_top_hexagons(
+    k: int = Query(20, ge=1, le=1000),
+    flags: schemas.PersonaFlags = Depends(),
+    bbox: Optional[tuple] = Depends(get_bbox),
+    store: StoreState = Depends(get_state)
+):
+    hex_ids, ratings = rating_cache.ratings(store, tuple(flags.dict().values()))
+    candidates = None if bbox is None else store.in_bbox(*bbox)
+    rows = top_k(ratings, k, candidates)
+    return {"hexagons": [
+        {
+            "hex_id": int(hex_ids[row]),
+            "rating": float(ratings[row]),
+            "center_lon": store.value(row, "center_lon"),
+            "center_lat": store.value(row, "center_lat"),
+        }
+        for row in rows
+    ]}
+
+@router.get("/viewport", response_model=List[schemas.Hexagon])
+def read_viewport_hexagons(
+    bbox: Optional[tuple] = Depends(get_bbox),
+    within: str = Query("polygon", regex="^(polygon|center)$"),
+    fields: Optional[tuple] = Depends(get_projection),
+    store: StoreState = Depends(get_state)
+):
+    if bbox is None:
+        raise HTTPException(status_code=422, detail="bbox is required")
+    if within == "center":
+        rows = np.flatnonzero(store.in_bbox(*bbox))
+    else:
+        rows = get_hexagon_index(store).overlapping(*bbox)
+    return hexagons_response(store, rows, fields)
+
+@router.get("/lod", response_model=schemas.LodCells)
+def read_lod_cells(
+    bbox: Optional[tuple] = Depends(get_bbox),
+    zoom: Optional[float] = Query(None, ge=0, le=24, description="Map zoom level of the viewport"),
+    max_cells: int = Query(1000, ge=1, le=100000),
+    flags: schemas.PersonaFlags = Depends(),
+    store: StoreState = Depends(get_state)
+):
+    """Cells of the finest pyramid level keeping the viewport (default: everything) within max_cells."""
+    pyramid = get_lod_pyramid(store)
+    level, cells = pyramid.select(bbox or (-180.0, -90.0, 180.0, 90.0), max_cells, zoom)
+    _, ratings = rating_cache.ratings(store, tuple(flags.dict().values()))
+    return FastJSONResponse({
+        "level": level,
+        "levels": len(pyramid.levels),
+        "radius_km": pyramid.levels[level].radius_km,
+        "cells": pyramid.levels[level].cells(cells, ratings),
+    })
+
+@router.get("/locate", response_model=schemas.LocatedHexagon)
+def locate_hexagon(lat: float, lon: float, store: StoreState = Depends(get_state)):
+    hex_id = get_hexagon_index(store).locate([lon], [lat])[0]
+    if hex_id is None:
+        raise HTTPException(status_code=404, detail="No hexagon at this point")
+    return {"hex_id": hex_id}
+
+@router.post("/locate", response_model=schemas.LocatedHexagons)
+def locate_hexagons(batch: schemas.PointBatch, store: StoreState = Depends(get_state)):
+    points = np.asarray(batch.points, dtype=np.float64).reshape(-1, 2)
+    return {"hex_ids": get_hexagon_index(store).locate(points[:, 0], points[:, 1])}
+
+@router.get("/ratings/cache")
+def read_rating_cache_stats():
+    return {**rating_cache.stats(), "metrics": metrics_flight.stats()}
+
+@router.get("/profiles")
+def read_weight_profiles():
+    features = list(weight_profiles.features.__members__)
+    return {
+        "version": weight_profiles.version,
+        "profiles": {
+            name: dict(zip(features, vector.tolist()))
+            for name, vector in weight_profiles.profiles.items()
+        },
+    }
+
+@router.post("/profiles/reload")
+def reload_weight_profiles():
+    try:
+        weight_profiles.reload()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Weight profiles not reloaded: {e}")
+    return {"version": weight_profiles.version}
+
+@sync_router.get("/{hexagon_id}", response_model=schemas.Hexagon)
+def read_hexagon(hexagon_id: int, fields: Optional[tuple] = Depends(get_projection), store: StoreState = Depends(get_state)):
+    return hexagon_response(store, hexagon_id, fields)
+
+@sync_router.get("/{hexagon_id}/metrics")
 def read_hexagon_metrics(
     hexagon_id: int, 
     builder_flg: bool = False,
@@ -31,16 +296,10 @@ def read_hexagon_metrics(
     pet_owner_flg: bool = False,
     big_family_flg: bool = False,
     old_family_flg: bool = False,
+    ring: tuple = Depends(get_rings),
     db: Session = Depends(get_db)
 ):
-    # Get the hexagon data
-    hexagon = db.query(HexagonData).filter(HexagonData.hex_id == hexagon_id).first()
-    if hexagon is None:
-        raise HTTPException(status_code=404, detail="Hexagon data not found")
-    
-    # Calculate rating based on provided flags
-    rating = calc_finaly_rating(
-        hexagon_id, 
+    flags = (
         builder_flg, 
         driver_flg, 
         uses_public_transport_flg, 
@@ -48,26 +307,78 @@ def read_hexagon_metrics(
         pet_owner_flg, 
         big_family_flg, 
         old_family_flg,
-        db
     )
+    rings, decay = ring
+    store = get_hexagon_store(db).state
+
+    def compute():
+        if rings > 1:
+            # Served from the rating engine's neighbour graph whatever RATING_SOURCE is
+            return ring_rating(store, hexagon_id, flags, rings, decay)
+        if settings.RATING_SOURCE == "db":
+            # Get the hexagon and its neighbours in one query
+            context = load_rating_context(db, hexagon_id)
+            return None if context is None else calc_finaly_rating(context, *flags)
+        if store.row_index(hexagon_id) is None:
+            return None
+        return rating_cache.rating(store, hexagon_id, flags)
+
+    rating = metrics_flight.call(metrics_key(store, hexagon_id, flags, rings, decay), compute)
+    if rating is None:
+        raise HTTPException(status_code=404, detail="Hexagon data not found")
     
     # Return metrics including the calculated rating
     metrics = {
-        "rating": rating,
+        "rating": float(rating),
     }
     
     return metrics
 
-@router.post("/", response_model=schemas.Hexagon)
-def create_hexagon(hexagon: schemas.HexagonCreate, db: Session = Depends(get_db)):
+@sync_router.post("/metrics:batch", response_model=schemas.MetricsMatrix)
+def read_hexagon_metrics_batch(
+    batch: schemas.MetricsBatch,
+    ring: tuple = Depends(get_rings),
+    db: Session = Depends(get_db)
+):
+    """/{hexagon_id}/metrics of every hex_id for every set of flags, the hexagons and neighbours loaded once."""
+    personas = [tuple(flags.dict().values()) for flags in batch.flags]
+    rings, decay = ring
+    if rings == 1 and settings.RATING_SOURCE == "db":
+        ratings = context_ratings(load_rating_contexts(db, batch.hex_ids), personas)
+    else:
+        ratings = batch_ratings(get_hexagon_store(db).state, batch.hex_ids, personas, rings, decay)
+    return metrics_matrix_response(batch.hex_ids, ratings)
+
+@sync_router.post("/", response_model=schemas.Hexagon)
+def create_hexagon(hexagon: schemas.HexagonCreate, db: Session = Depends(get_db), store: HexagonStore = Depends(get_store)):
     db_hexagon = HexagonData(**hexagon.dict())
     db.add(db_hexagon)
     db.commit()
     db.refresh(db_hexagon)
+    store.upsert(db_hexagon)
+    rating_cache.invalidate(store, int(db_hexagon.hex_id))
     return db_hexagon
 
-@router.put("/{hexagon_id}", response_model=schemas.Hexagon)
-def update_hexagon(hexagon_id: int, hexagon: schemas.HexagonUpdate, db: Session = Depends(get_db)):
+@sync_router.post(":bulk", response_model=schemas.BulkResult)
+def create_hexagons(batch: schemas.HexagonBulkItems, atomic: bool = False, db: Session = Depends(get_db), store: HexagonStore = Depends(get_store)):
+    hexagons, errors = bulk_create(db, batch.items, atomic)
+    apply_to_store(store, written=hexagons)
+    return {"hex_ids": [h.hex_id for h in hexagons], "errors": errors}
+
+@sync_router.patch(":bulk", response_model=schemas.BulkResult)
+def patch_hexagons(batch: schemas.HexagonBulkItems, atomic: bool = False, db: Session = Depends(get_db), store: HexagonStore = Depends(get_store)):
+    hexagons, errors = bulk_update(db, batch.items, atomic)
+    apply_to_store(store, written=hexagons)
+    return {"hex_ids": [h.hex_id for h in hexagons], "errors": errors}
+
+@sync_router.delete(":bulk", response_model=schemas.BulkResult)
+def delete_hexagons(batch: schemas.HexagonBulkIds, atomic: bool = False, db: Session = Depends(get_db), store: HexagonStore = Depends(get_store)):
+    hex_ids, errors = bulk_delete(db, batch.hex_ids, atomic)
+    apply_to_store(store, deleted=hex_ids)
+    return {"hex_ids": hex_ids, "errors": errors}
+
+@sync_router.put("/{hexagon_id}", response_model=schemas.Hexagon)
+def update_hexagon(hexagon_id: int, hexagon: schemas.HexagonUpdate, db: Session = Depends(get_db), store: HexagonStore = Depends(get_store)):
     db_hexagon = db.query(HexagonData).filter(HexagonData.hex_id == hexagon_id).first()
     if db_hexagon is None:
         raise HTTPException(status_code=404, detail="Hexagon data not found")
@@ -78,10 +389,12 @@ def update_hexagon(hexagon_id: int, hexagon: schemas.HexagonUpdate, db: Session
     
     db.commit()
     db.refresh(db_hexagon)
+    store.upsert(db_hexagon)
+    rating_cache.invalidate(store, int(db_hexagon.hex_id))
     return db_hexagon
 
-@router.patch("/{hexagon_id}", response_model=schemas.Hexagon)
-def patch_hexagon(hexagon_id: int, hexagon: schemas.HexagonUpdate, db: Session = Depends(get_db)):
+@sync_router.patch("/{hexagon_id}", response_model=schemas.Hexagon)
+def patch_hexagon(hexagon_id: int, hexagon: schemas.HexagonUpdate, db: Session = Depends(get_db), store: HexagonStore = Depends(get_store)):
     db_hexagon = db.query(HexagonData).filter(HexagonData.hex_id == hexagon_id).first()
     if db_hexagon is None:
         raise HTTPException(status_code=404, detail="Hexagon data not found")
@@ -92,14 +405,18 @@ def patch_hexagon(hexagon_id: int, hexagon: schemas.HexagonUpdate, db: Session =
     
     db.commit()
     db.refresh(db_hexagon)
+    store.upsert(db_hexagon)
+    rating_cache.invalidate(store, int(db_hexagon.hex_id))
     return db_hexagon
 
-@router.delete("/{hexagon_id}")
-def delete_hexagon(hexagon_id: int, db: Session = Depends(get_db)):
+@sync_router.delete("/{hexagon_id}")
+def delete_hexagon(hexagon_id: int, db: Session = Depends(get_db), store: HexagonStore = Depends(get_store)):
     db_hexagon = db.query(HexagonData).filter(HexagonData.hex_id == hexagon_id).first()
     if db_hexagon is None:
         raise HTTPException(status_code=404, detail="Hexagon data not found")
     
     db.delete(db_hexagon)
     db.commit()
+    store.remove(hexagon_id)
+    rating_cache.invalidate(store, hexagon_id)
     return {"message": "Hexagon data deleted successfully"}
\ No newline at end of file
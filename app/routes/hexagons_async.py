@@ -0,0 +1,135 @@
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+import schemas
+import settings
+from database.database import get_async_db
+from models.hexagon import HexagonData
+from routes.hexagons import (
+    batch_ratings, context_ratings, get_projection, get_rings, hexagon_response, metrics_key, metrics_matrix_response,
+    ring_rating,
+)
+from services.hexagon_bulk import apply_to_store, bulk_create, bulk_delete, bulk_update
+from services.hexagon_ratings import calc_finaly_rating, load_rating_context_async, load_rating_contexts_async
+from services.hexagon_store import HexagonStore, StoreState, get_hexagon_store, hexagon_store
+from services.profiling import ProfiledRoute
+from services.rating_cache import rating_cache
+from services.single_flight import metrics_flight
+
+
+# Async variants of the record endpoints in routes.hexagons (sync_router), used
+# when settings.DB_MODE is "async". Store and rating work is in memory and runs
+# inline; only database round trips are awaited.
+router = APIRouter(prefix="/hexagons", tags=["hexagons"], route_class=ProfiledRoute)
+
+async def get_async_store(db: AsyncSession = Depends(get_async_db)):
+    if hexagon_store.loaded:
+        return hexagon_store
+    return await db.run_sync(get_hexagon_store)
+
+async def get_async_state(store: HexagonStore = Depends(get_async_store)):
+    return store.state
+
+async def get_hexagon_row(db: AsyncSession, hexagon_id: int):
+    result = await db.execute(select(HexagonData).where(HexagonData.hex_id == hexagon_id))
+    db_hexagon = result.scalars().first()
+    if db_hexagon is None:
+        raise HTTPException(status_code=404, detail="Hexagon data not found")
+    return db_hexagon
+
+@router.get("/{hexagon_id}", response_model=schemas.Hexagon)
+async def read_hexagon(hexagon_id: int, fields: Optional[tuple] = Depends(get_projection), store: StoreState = Depends(get_async_state)):
+    return hexagon_response(store, hexagon_id, fields)
+
+@router.get("/{hexagon_id}/metrics")
+async def read_hexagon_metrics(
+    hexagon_id: int,
+    flags: schemas.PersonaFlags = Depends(),
+    ring: tuple = Depends(get_rings),
+    db: AsyncSession = Depends(get_async_db)
+):
+    flags = tuple(flags.dict().values())
+    rings, decay = ring
+    store = (await get_async_store(db)).state
+
+    async def compute():
+        if rings > 1:
+            return ring_rating(store, hexagon_id, flags, rings, decay)
+        if settings.RATING_SOURCE == "db":
+            context = await load_rating_context_async(db, hexagon_id)
+            return None if context is None else calc_finaly_rating(context, *flags)
+        if store.row_index(hexagon_id) is None:
+            return None
+        return rating_cache.rating(store, hexagon_id, flags)
+
+    rating = await metrics_flight.call_async(metrics_key(store, hexagon_id, flags, rings, decay), compute)
+    if rating is None:
+        raise HTTPException(status_code=404, detail="Hexagon data not found")
+    return {"rating": float(rating)}
+
+@router.post("/metrics:batch", response_model=schemas.MetricsMatrix)
+async def read_hexagon_metrics_batch(
+    batch: schemas.MetricsBatch,
+    ring: tuple = Depends(get_rings),
+    db: AsyncSession = Depends(get_async_db)
+):
+    personas = [tuple(flags.dict().values()) for flags in batch.flags]
+    rings, decay = ring
+    if rings == 1 and settings.RATING_SOURCE == "db":
+        ratings = context_ratings(await load_rating_contexts_async(db, batch.hex_ids), personas)
+    else:
+        ratings = batch_ratings((await get_async_store(db)).state, batch.hex_ids, personas, rings, decay)
+    return metrics_matrix_response(batch.hex_ids, ratings)
+
+@router.post("/", response_model=schemas.Hexagon)
+async def create_hexagon(hexagon: schemas.HexagonCreate, db: AsyncSession = Depends(get_async_db), store: HexagonStore = Depends(get_async_store)):
+    db_hexagon = HexagonData(**hexagon.dict())
+    db.add(db_hexagon)
+    await db.commit()
+    await db.refresh(db_hexagon)
+    store.upsert(db_hexagon)
+    rating_cache.invalidate(store, int(db_hexagon.hex_id))
+    return db_hexagon
+
+@router.post(":bulk", response_model=schemas.BulkResult)
+async def create_hexagons(batch: schemas.HexagonBulkItems, atomic: bool = False, db: AsyncSession = Depends(get_async_db), store: HexagonStore = Depends(get_async_store)):
+    hexagons, errors = await db.run_sync(bulk_create, batch.items, atomic)
+    apply_to_store(store, written=hexagons)
+    return {"hex_ids": [h.hex_id for h in hexagons], "errors": errors}
+
+@router.patch(":bulk", response_model=schemas.BulkResult)
+async def patch_hexagons(batch: schemas.HexagonBulkItems, atomic: bool = False, db: AsyncSession = Depends(get_async_db), store: HexagonStore = Depends(get_async_store)):
+    hexagons, errors = await db.run_sync(bulk_update, batch.items, atomic)
+    apply_to_store(store, written=hexagons)
+    return {"hex_ids": [h.hex_id for h in hexagons], "errors": errors}
+
+@router.delete(":bulk", response_model=schemas.BulkResult)
+async def delete_hexagons(batch: schemas.HexagonBulkIds, atomic: bool = False, db: AsyncSession = Depends(get_async_db), store: HexagonStore = Depends(get_async_store)):
+    hex_ids, errors = await db.run_sync(bulk_delete, batch.hex_ids, atomic)
+    apply_to_store(store, deleted=hex_ids)
+    return {"hex_ids": hex_ids, "errors": errors}
+
+@router.put("/{hexagon_id}", response_model=schemas.Hexagon)
+async def update_hexagon(hexagon_id: int, hexagon: schemas.HexagonUpdate, db: AsyncSession = Depends(get_async_db), store: HexagonStore = Depends(get_async_store)):
+    db_hexagon = await get_hexagon_row(db, hexagon_id)
+    for key, value in hexagon.dict(exclude_unset=True).items():
+        setattr(db_hexagon, key, value)
+    await db.commit()
+    await db.refresh(db_hexagon)
+    store.upsert(db_hexagon)
+    rating_cache.invalidate(store, int(db_hexagon.hex_id))
+    return db_hexagon
+
+@router.patch("/{hexagon_id}", response_model=schemas.Hexagon)
+async def patch_hexagon(hexagon_id: int, hexagon: schemas.HexagonUpdate, db: AsyncSession = Depends(get_async_db), store: HexagonStore = Depends(get_async_store)):
+    return await update_hexagon(hexagon_id, hexagon, db, store)
+
+@router.delete("/{hexagon_id}")
+async def delete_hexagon(hexagon_id: int, db: AsyncSession = Depends(get_async_db), store: HexagonStore = Depends(get_async_store)):
+    db_hexagon = await get_hexagon_row(db, hexagon_id)
+    await db.delete(db_hexagon)
+    await db.commit()
+    store.remove(hexagon_id)
+    rating_cache.invalidate(store, hexagon_id)
+    return {"message": "Hexagon data deleted successfully"}
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from services.instrumentation import metrics
+
+
+router = APIRouter(prefix="/metrics", tags=["internal"])
+
+@router.get("/internal", response_class=PlainTextResponse)
+def read_internal_metrics():
+    """Request latency, SQL and span metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1 +1,4 @@
-from .hexagon import Hexagon, HexagonCreate, HexagonUpdate
+from .hexagon import Hexagon, HexagonCreate, HexagonUpdate, HEXAGON_VIEWS, hexagon_projection
+from .rating import PersonaFlags, HexagonRatings, WeightVector, RankedHexagon, TopHexagons, MetricsBatch, MetricsMatrix
+from .spatial import LocatedHexagon, PointBatch, LocatedHexagons, LodCell, LodCells
+from .bulk import HexagonBulkItems, HexagonBulkIds, HexagonCreateItem, HexagonPatchItem, BulkItemError, BulkResult
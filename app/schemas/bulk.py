@@ -0,0 +1,28 @@
+from pydantic import BaseModel, conint
+from typing import Any, List, Optional
+from .hexagon import HexagonCreate, HexagonUpdate
+
+# Items are validated one by one (see services.hexagon_bulk) so that a bad item
+# is reported in BulkResult.errors instead of failing the whole request
+class HexagonBulkItems(BaseModel):
+    items: List[dict]
+
+class HexagonBulkIds(BaseModel):
+    hex_ids: List[int]
+
+class HexagonCreateItem(HexagonCreate):
+    # Assigned after the current maximum when omitted; at most
+    # services.hexagon_bulk.MAX_HEX_ID_GAP past it when given
+    hex_id: Optional[conint(gt=0)] = None
+
+class HexagonPatchItem(HexagonUpdate):
+    hex_id: int
+
+class BulkItemError(BaseModel):
+    index: int
+    hex_id: Optional[int] = None
+    detail: Any
+
+class BulkResult(BaseModel):
+    hex_ids: List[int]
+    errors: List[BulkItemError]
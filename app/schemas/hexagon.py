@@ -1,5 +1,7 @@
-from pydantic import BaseModel
-from typing import Optional
+from functools import lru_cache
+from pydantic import BaseModel, create_model, validator
+from typing import Optional, Tuple
+from models import codec
 
 class HexagonDataBase(BaseModel):
     center_lon: Optional[float] = None
@@ -28,10 +30,31 @@ class HexagonDataBase(BaseModel):
     roads_list_json: Optional[str] = None
     neighbours: Optional[str] = None
 
-class HexagonCreate(HexagonDataBase):
+class HexagonWrite(HexagonDataBase):
+    # The JSON columns are stored packed; reject anything that cannot be packed
+    @validator("peaks_json")
+    def check_peaks_json(cls, value):
+        return _packable(codec.peaks_from_text, value)
+
+    @validator("roads_list_json")
+    def check_roads_list_json(cls, value):
+        return _packable(codec.road_ids_from_text, value)
+
+    @validator("neighbours")
+    def check_neighbours(cls, value):
+        return _packable(codec.ids_from_text, value)
+
+def _packable(pack, value):
+    try:
+        pack(value)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"cannot be packed: {e}")
+    return value
+
+class HexagonCreate(HexagonWrite):
     pass
 
-class HexagonUpdate(HexagonDataBase):
+class HexagonUpdate(HexagonWrite):
     pass
 
 class HexagonInDBBase(HexagonDataBase):
@@ -39,4 +62,20 @@ class HexagonInDBBase(HexagonDataBase):
         orm_mode = True
 
 class Hexagon(HexagonInDBBase):
-    pass
\ No newline at end of file
+    pass
+
+# Named column sets for ?view=; "full" is every column of HexagonDataBase
+HEXAGON_VIEWS = {
+    "summary": tuple(name for name in HexagonDataBase.__fields__ if name not in ("peaks_json", "roads_list_json", "neighbours")),
+    "geometry": ("center_lon", "center_lat", "peaks_json"),
+    "full": tuple(HexagonDataBase.__fields__),
+}
+
+@lru_cache(maxsize=128)
+def hexagon_projection(fields: Tuple[str, ...]):
+    """Response model holding hex_id plus only the requested columns."""
+    return create_model(
+        "HexagonProjection",
+        hex_id=(int, ...),
+        **{name: (HexagonDataBase.__fields__[name].outer_type_, None) for name in fields},
+    )
@@ -0,0 +1,37 @@
+from pydantic import BaseModel, conlist
+from typing import Dict, List, Optional
+
+class PersonaFlags(BaseModel):
+    builder_flg: bool = False
+    driver_flg: bool = False
+    uses_public_transport_flg: bool = False
+    parent_flg: bool = False
+    pet_owner_flg: bool = False
+    big_family_flg: bool = False
+    old_family_flg: bool = False
+
+class HexagonRatings(BaseModel):
+    ratings: Dict[int, float]
+
+class WeightVector(BaseModel):
+    weights: Dict[str, float]
+    base: Optional[str] = None
+
+class RankedHexagon(BaseModel):
+    hex_id: int
+    rating: float
+    center_lon: Optional[float] = None
+    center_lat: Optional[float] = None
+
+class TopHexagons(BaseModel):
+    hexagons: List[RankedHexagon]
+
+class MetricsBatch(BaseModel):
+    hex_ids: conlist(int, min_items=1, max_items=1000)
+    # One persona per set of flags
+    flags: conlist(PersonaFlags, min_items=1, max_items=64)
+
+class MetricsMatrix(BaseModel):
+    hex_ids: List[int]
+    # ratings[i][j] is hex_ids[i] rated for flags[j]; null for a hexagon that does not exist
+    ratings: List[Optional[List[float]]]
@@ -0,0 +1,31 @@
+from pydantic import BaseModel, Extra, conlist
+from typing import List, Optional, Tuple
+
+class LocatedHexagon(BaseModel):
+    hex_id: int
+
+class PointBatch(BaseModel):
+    # [lon, lat] pairs, same order as peaks_json
+    points: conlist(Tuple[float, float], max_items=10000)
+
+class LocatedHexagons(BaseModel):
+    hex_ids: List[Optional[int]]
+
+class LodCell(BaseModel):
+    # hex_id on level 0, numbered within the level above it
+    cell_id: int
+    hexagons: int
+    center_lon: float
+    center_lat: float
+    peaks: List[Tuple[float, float]]
+    rating: float
+
+    # Plus the hexagon columns aggregated over the cell (see services.lod)
+    class Config:
+        extra = Extra.allow
+
+class LodCells(BaseModel):
+    level: int
+    levels: int
+    radius_km: float
+    cells: List[LodCell]
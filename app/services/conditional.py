@@ -0,0 +1,128 @@
+import hashlib
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from starlette.routing import Match
+from services.grid import choose_encoding
+from services.hexagon_ratings import weight_profiles
+
+# GET responses under this prefix depend only on the store and the weight profiles
+PREFIX = "/hexagons"
+# ... except these, which report process state
+UNCACHED = {"/hexagons/ratings/cache"}
+# Served in the content coding negotiated from Accept-Encoding (see services.grid)
+ENCODED = {"/hexagons/grid"}
+
+
+def validators(store, scope):
+    """(ETag, Last-Modified timestamp) of a GET response for the data as it is now.
+
+    The ETag covers the store revision, the weight profiles file and the
+    request path and query, plus the content coding for ENCODED paths, whose
+    br, gzip and identity bodies differ byte for byte. Last-Modified is None
+    while the data is less than a second old: HTTP dates have one-second
+    resolution, so a change later in that same second could not be told
+    apart from it.
+    """
+    state = store.state
+    key = "\n".join((
+        state.revision, repr(weight_profiles.mtime), scope["path"], scope["query_string"].decode("latin-1"),
+    ))
+    etag = hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+    if scope["path"] in ENCODED:
+        etag += "-" + choose_encoding(dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1"))
+    etag = f'"{etag}"'
+    modified_at = max(state.modified_at, weight_profiles.loaded_at)
+    return etag, (int(modified_at) if time.time() - modified_at >= 1 else None)
+
+
+def if_none_match_tags(headers):
+    """Entity tags listed in If-None-Match, None without the header."""
+    if_none_match = headers.get(b"if-none-match")
+    if if_none_match is None:
+        return None
+    return [tag.strip() for tag in if_none_match.decode("latin-1").split(",")]
+
+
+def not_modified(headers, etag, last_modified):
+    """Whether the request's If-None-Match / If-Modified-Since already match (If-None-Match wins).
+
+    ``If-None-Match: *`` is left out: it matches only if the resource exists,
+    which the route decides.
+    """
+    tags = if_none_match_tags(headers)
+    if tags is not None:
+        # Weak comparison, as for If-None-Match
+        return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+    if_modified_since = headers.get(b"if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since.decode("latin-1")).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return last_modified <= since
+
+
+class ConditionalMiddleware:
+    """ETag / Last-Modified on read responses, and 304 Not Modified when they still match.
+
+    The validators are computed before the request reaches its route, so a
+    304 is answered without routing, a database session or any store work;
+    only ``If-None-Match: *`` goes through the route, and gets a 304 in place
+    of a 200 (a 404 stays a 404). A write landing while a request runs can
+    only make its ETag older than its content, which costs the client a full
+    response next time, never a stale one.
+    """
+
+    def __init__(self, app, store):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if (scope["type"] != "http" or scope["method"] != "GET" or not path.startswith(PREFIX)
+                or path in UNCACHED or not self.store.loaded):
+            await self.app(scope, receive, send)
+            return
+
+        etag, last_modified = validators(self.store, scope)
+        headers = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+        if last_modified is not None:
+            headers.append((b"last-modified", formatdate(last_modified, usegmt=True).encode()))
+
+        # As the 200 response would have it
+        headers_304 = headers + [(b"vary", b"Accept-Encoding")] if path in ENCODED else headers
+        request_headers = dict(scope["headers"])
+        if not_modified(request_headers, etag, last_modified):
+            self._match_route(scope)
+            await send({"type": "http.response.start", "status": 304, "headers": headers_304})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if_exists = "*" in (if_none_match_tags(request_headers) or ())
+        replaced = False
+
+        async def send_with_validators(message):
+            nonlocal replaced
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                if if_exists:
+                    replaced = True
+                    message = {"type": "http.response.start", "status": 304, "headers": headers_304}
+                else:
+                    message = {**message, "headers": list(message.get("headers", [])) + headers}
+            elif message["type"] == "http.response.body" and replaced:
+                if message.get("more_body", False):
+                    return
+                message = {"type": "http.response.body", "body": b""}
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
+
+    @staticmethod
+    def _match_route(scope):
+        # Resolve the endpoint as the router would, so a 304 is still counted under its route
+        for route in scope["app"].router.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                scope.update(child_scope)
+                return
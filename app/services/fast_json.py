@@ -0,0 +1,65 @@
+import numpy as np
+import orjson
+from fastapi.responses import JSONResponse
+from sqlalchemy import Float
+from models.hexagon import HexagonData
+from services.hexagon_store import COLUMNS, PACKED_COLUMNS
+
+# orjson spells floats of magnitude below 1e-4 without an exponent ("0.00001"),
+# where json.dumps, and so JSONResponse, writes "1e-05"; those few are passed as
+# pre-rendered fragments so both paths give byte-identical output
+_EXPONENT_BELOW = 1e-4
+FLOAT_COLUMNS = {column.name for column in HexagonData.__table__.columns if isinstance(column.type, Float)}
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson, for content that is already plain JSON data.
+
+    Nothing is validated or converted on the way: build the content with
+    ``float_list``/``store_rows`` (or from plain Python values) so it renders
+    exactly as JSONResponse would.
+    """
+
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def float_list(values):
+    """A float array as a list orjson renders the way json.dumps does."""
+    values = np.asarray(values, dtype=np.float64)
+    if not np.isfinite(values).all():
+        # Same refusal as JSONResponse (allow_nan=False)
+        raise ValueError("Out of range float values are not JSON compliant")
+    result = values.tolist()
+    for i in np.flatnonzero((values != 0) & (np.abs(values) < _EXPONENT_BELOW)).tolist():
+        result[i] = orjson.Fragment(repr(result[i]))
+    return result
+
+
+def store_rows(store, rows, fields=None):
+    """Rows of the store as JSON-ready dicts, built column by column.
+
+    Without fields each dict has every column in schemas.Hexagon order (no
+    hex_id), as the validated response_model path renders it; with fields it
+    is hex_id plus those columns, as ``schemas.hexagon_projection`` does.
+    """
+    store = store.state
+    rows = np.asarray(rows, dtype=np.int64)
+    names = list(COLUMNS) if fields is None else ["hex_id", *fields]
+    columns = []
+    for name in names:
+        if name == "hex_id":
+            column = store.hex_ids[rows].tolist()
+        elif name in PACKED_COLUMNS:
+            _, attr, _, to_json = PACKED_COLUMNS[name]
+            packed = getattr(store, attr)
+            column = [to_json(packed[row]) for row in rows.tolist()]
+        elif name in FLOAT_COLUMNS:
+            column = float_list(store.columns[name][rows])
+        else:
+            column = store.columns[name][rows].tolist()
+        if name in store.nulls:
+            for i in np.flatnonzero(store.nulls[name][rows]).tolist():
+                column[i] = None
+        columns.append(column)
+    return [dict(zip(names, values)) for values in zip(*columns)]
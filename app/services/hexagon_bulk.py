@@ -0,0 +1,117 @@
+from pydantic import ValidationError
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+import schemas
+from models.hexagon import HexagonData
+from services.hexagon_store import SOURCES
+from services.rating_cache import rating_cache
+
+
+# Batch writes: every valid item is applied with one executemany per statement
+# shape inside a single transaction, and items that fail validation or refer to
+# a missing/duplicate hex_id come back as per-item errors. With atomic=True any
+# error leaves the database untouched. The functions take a sync Session; the
+# async routes run them through AsyncSession.run_sync.
+
+# How far past the current maximum an explicit hex_id may go: the store and the
+# rating cache index dense arrays by hex_id, so one huge id would size them all
+MAX_HEX_ID_GAP = 10000
+
+def _error(index, hex_id, detail):
+    return {"index": index, "hex_id": hex_id, "detail": detail}
+
+def _validate(model, items, errors):
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, model.parse_obj(item)))
+        except ValidationError as e:
+            errors.append(_error(index, item.get("hex_id"), e.errors()))
+    return valid
+
+def _existing(db: Session, hex_ids):
+    if not hex_ids:
+        return set()
+    return set(db.execute(select(HexagonData.hex_id).where(HexagonData.hex_id.in_(set(hex_ids)))).scalars())
+
+def _finish(db: Session, errors, atomic):
+    """Commit unless atomic and some item failed; True when committed."""
+    errors.sort(key=lambda error: error["index"])
+    if atomic and errors:
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+def bulk_create(db: Session, items, atomic=False):
+    """Insert the items; returns (created HexagonData rows, errors)."""
+    errors = []
+    valid = _validate(schemas.HexagonCreateItem, items, errors)
+    current = db.query(func.max(HexagonData.hex_id)).scalar() or 0
+    ceiling = current + MAX_HEX_ID_GAP
+    explicit = [item.hex_id for _, item in valid if item.hex_id is not None and item.hex_id <= ceiling]
+    taken = _existing(db, explicit)
+    next_id = max(current, max(explicit, default=0)) + 1
+    hexagons = []
+    for index, item in valid:
+        hex_id = item.hex_id
+        if hex_id is None:
+            hex_id = next_id
+            next_id += 1
+        elif hex_id > ceiling:
+            errors.append(_error(index, hex_id, f"hex_id must not exceed {ceiling} (current maximum + {MAX_HEX_ID_GAP})"))
+            continue
+        elif hex_id in taken:
+            errors.append(_error(index, hex_id, "Hexagon already exists"))
+            continue
+        taken.add(hex_id)
+        hexagons.append(HexagonData(hex_id=hex_id, **item.dict(exclude={"hex_id"})))
+
+    columns = [column.name for column in HexagonData.__table__.columns]
+    if hexagons and not (atomic and errors):
+        db.bulk_insert_mappings(HexagonData, [{name: getattr(h, name) for name in columns} for h in hexagons])
+    return (hexagons if _finish(db, errors, atomic) else []), errors
+
+def bulk_update(db: Session, items, atomic=False):
+    """Apply partial updates (PATCH semantics); returns (updated HexagonData rows, errors)."""
+    errors = []
+    valid = _validate(schemas.HexagonPatchItem, items, errors)
+    found = _existing(db, [item.hex_id for _, item in valid])
+    mappings = {}
+    for index, item in valid:
+        if item.hex_id not in found:
+            errors.append(_error(index, item.hex_id, "Hexagon data not found"))
+            continue
+        fields = item.dict(exclude_unset=True, exclude={"hex_id"})
+        # Transient row, only used to pack the JSON fields into their columns
+        packed = HexagonData(**fields)
+        mapping = mappings.setdefault(item.hex_id, {"hex_id": item.hex_id})
+        mapping.update({SOURCES[name]: getattr(packed, SOURCES[name]) for name in fields})
+
+    changed = [mapping for mapping in mappings.values() if len(mapping) > 1]
+    if changed and not (atomic and errors):
+        db.bulk_update_mappings(HexagonData, changed)
+    if not _finish(db, errors, atomic) or not mappings:
+        return [], errors
+    return db.query(HexagonData).filter(HexagonData.hex_id.in_(list(mappings))).all(), errors
+
+def bulk_delete(db: Session, hex_ids, atomic=False):
+    """Delete the hexagons; returns (deleted hex_ids, errors)."""
+    errors = []
+    found = _existing(db, hex_ids)
+    for index, hex_id in enumerate(hex_ids):
+        if hex_id not in found:
+            errors.append(_error(index, hex_id, "Hexagon data not found"))
+    if found and not (atomic and errors):
+        db.query(HexagonData).filter(HexagonData.hex_id.in_(found)).delete(synchronize_session=False)
+    return (sorted(found) if _finish(db, errors, atomic) else []), errors
+
+def apply_to_store(store, written=(), deleted=()):
+    """Mirror a committed batch in the store, invalidating ratings once for all of it."""
+    if written:
+        store.upsert_many(written)
+    if deleted:
+        store.remove_many(deleted)
+    hex_ids = [int(h.hex_id) for h in written] + list(deleted)
+    if hex_ids:
+        rating_cache.invalidate_many(store, hex_ids)
@@ -0,0 +1,49 @@
+import orjson
+from sqlalchemy import select
+from database.database import SessionLocal
+from models import codec
+from models.hexagon import HexagonData
+from services.hexagon_store import COLUMNS, SOURCES
+
+
+EXPORT_BATCH_SIZE = 500
+# Packed columns are exported as the JSON text the API returns for them
+TO_TEXT = {
+    "peaks_json": codec.peaks_to_text,
+    "roads_list_json": codec.road_ids_to_text,
+    "neighbours": codec.ids_to_text,
+}
+
+
+def export_ndjson(after=None, fields=None):
+    """Yield every hexagon with hex_id > after as one compact JSON line (orjson), in hex_id order.
+
+    Rows are read in keyset batches of EXPORT_BATCH_SIZE, so memory stays flat
+    however large the table is. Only hex_id and ``fields`` (all columns when
+    None) are selected. Each batch checks a connection out and back in before
+    its lines are yielded: a slow client never holds one while the next chunk
+    waits for a threadpool worker, which with enough concurrent exports would
+    leave every worker blocked on the pool. The batches are separate reads, so
+    a write landing mid-export shows from the next batch on.
+    """
+    hex_id = HexagonData.hex_id
+    names = [name for name in COLUMNS if fields is None or name in fields]
+    columns = [HexagonData.__table__.c[SOURCES[name]].label(name) for name in names]
+    query = select(hex_id.label("hex_id"), *columns).order_by(hex_id).limit(EXPORT_BATCH_SIZE)
+
+    while True:
+        db = SessionLocal()
+        try:
+            rows = db.execute(query if after is None else query.where(hex_id > after)).all()
+        finally:
+            db.close()
+        if not rows:
+            return
+        after = rows[-1].hex_id
+        yield b"".join(orjson.dumps(_row(row._mapping)) + b"\n" for row in rows)
+        if len(rows) < EXPORT_BATCH_SIZE:
+            return
+
+
+def _row(mapping):
+    return {name: TO_TEXT[name](value) if name in TO_TEXT else value for name, value in mapping.items()}
@@ -5,15 +5,20 @@ from operator import index
 from enum import Enum
 from fastapi import APIRouter, HTTPException, Depends
 from database.database import get_db
-from sqlalchemy.orm import Session
+from sqlalchemy import func, or_, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+from typing import NamedTuple
+from models import codec
 from models.hexagon import HexagonData
 import json
+import settings
+from services.instrumentation import span
+from services.weight_profiles import WeightProfileRegistry
 
 
-def get_neighbors(idx, db):
-    hexagon = db.query(HexagonData).filter(HexagonData.hex_id == idx).first()
-    neigbors = json.loads(hexagon.neighbours)
-    return neigbors
+def get_neighbors(idx, store):
+    return store.neighbours(idx)
 
 class Places(Enum):
     ROAD_TYPE_1 = 0 # фед трасса
@@ -60,201 +65,184 @@ neighbor_effect[Places.FACTORIES.value] = 0.8
 neighbor_effect[Places.HOSPITAL.value] = 0.8
 neighbor_effect[Places.SHOP.value] = 0.4
 
-def calc_rating(idx, builder_flg, driver_flg, 
-                uses_public_transport_flg, parent_flg, 
-                pet_owner_flg, big_family_flg, old_family_flg,
-                db: Session):
+weight_profiles = WeightProfileRegistry(Places, settings.WEIGHT_PROFILES_PATH)
+
+def calc_weights(builder_flg, driver_flg,
+                 uses_public_transport_flg, parent_flg,
+                 pet_owner_flg, big_family_flg, old_family_flg):
+
+    return weight_profiles.weights(builder_flg, driver_flg,
+                                   uses_public_transport_flg, parent_flg,
+                                   pet_owner_flg, big_family_flg, old_family_flg)
+
+# Columns a rating needs; load_rating_context selects only these
+RATING_COLUMNS = [
+    HexagonData.hex_id,
+    HexagonData.count_road_type_1,
+    HexagonData.count_road_type_2,
+    HexagonData.count_road_type_3,
+    HexagonData.count_road_type_4,
+    HexagonData.count_road_type_5,
+    HexagonData.count_road_type_6,
+    HexagonData.count_road_type_7,
+    HexagonData.count_road_type_9,
+    HexagonData.avg_speed,
+    HexagonData.avg_limit,
+    HexagonData.stop_count,
+    HexagonData.unique_routes_count,
+    HexagonData.pedestrian_roads_count,
+    HexagonData.dominant_coverage_type,
+    HexagonData.count_parks,
+    HexagonData.count_schools,
+    HexagonData.count_hospitals,
+    HexagonData.count_shops,
+    HexagonData.count_factories,
+]
+
+RATING_NAMES = [column.name for column in RATING_COLUMNS[1:]]
+
+class RatingContext(NamedTuple):
+    """Feature values of a hexagon and of each neighbour present in the table."""
+    hex_id: int
+    values: list
+    neighbour_values: list
+
+def feature_values(hexagon):
 
-    hexagon = db.query(HexagonData).filter(HexagonData.hex_id == idx).first()
-    
     values = [0] * 20
-    values[Places.ROAD_TYPE_1.value] = hexagon.count_road_type_1
-    values[Places.ROAD_TYPE_2.value] = hexagon.count_road_type_2
-    values[Places.ROAD_TYPE_3.value] = hexagon.count_road_type_3
-    values[Places.ROAD_TYPE_4.value] = hexagon.count_road_type_4
-    values[Places.ROAD_TYPE_5.value] = hexagon.count_road_type_5
-    values[Places.ROAD_TYPE_6.value] = hexagon.count_road_type_6
-    values[Places.ROAD_TYPE_7.value] = hexagon.count_road_type_7
+    values[Places.ROAD_TYPE_1.value] = hexagon["count_road_type_1"]
+    values[Places.ROAD_TYPE_2.value] = hexagon["count_road_type_2"]
+    values[Places.ROAD_TYPE_3.value] = hexagon["count_road_type_3"]
+    values[Places.ROAD_TYPE_4.value] = hexagon["count_road_type_4"]
+    values[Places.ROAD_TYPE_5.value] = hexagon["count_road_type_5"]
+    values[Places.ROAD_TYPE_6.value] = hexagon["count_road_type_6"]
+    values[Places.ROAD_TYPE_7.value] = hexagon["count_road_type_7"]
     values[Places.ROAD_TYPE_8.value] = 0
-    values[Places.ROAD_TYPE_9.value] = hexagon.count_road_type_9
-
-    values[Places.AVG_SPEED.value] = hexagon.avg_speed
-    values[Places.AVG_LIMIT.value] = hexagon.avg_limit
-    values[Places.STOP_COUNT.value] = hexagon.stop_count
-    values[Places.UNQ_ROUTES.value] = hexagon.unique_routes_count
-    values[Places.PED_ROAD_COUNT.value] = hexagon.pedestrian_roads_count
-    values[Places.DOM_COV_TYPE_IS_ASH.value] = hexagon.dominant_coverage_type == "Асфальт"
-    values[Places.PARK.value] = hexagon.count_parks
-    values[Places.SCHOOL.value] = hexagon.count_schools
-    values[Places.HOSPITAL.value] = hexagon.count_hospitals
-    values[Places.SHOP.value] = hexagon.count_shops
-    values[Places.FACTORIES.value] = hexagon.count_factories
-    
-    default = [0]*20
-
-    default[Places.FACTORIES.value]= -15
-    default[Places.ROAD_TYPE_1.value]= -15
-    default[Places.ROAD_TYPE_2.value]= -10
-    default[Places.ROAD_TYPE_3.value]= -5
-
-
-    builder = default.copy()
-    builder[Places.ROAD_TYPE_4.value]= 10
-    builder[Places.ROAD_TYPE_5.value]= 10
-    builder[Places.ROAD_TYPE_6.value]= 10
-    builder[Places.ROAD_TYPE_7.value]= 10
-    builder[Places.ROAD_TYPE_8.value]= 0
-    builder[Places.ROAD_TYPE_9.value]= 10
-    builder[Places.UNQ_ROUTES.value]= 15
-    builder[Places.STOP_COUNT.value]= 15
-    builder[Places.PED_ROAD_COUNT.value]= 5
-    builder[Places.SHOP.value]= 20
-    builder[Places.HOSPITAL.value]= 20
-    builder[Places.SCHOOL.value]= 20
-
-
-    driver= default.copy()
-    driver[Places.ROAD_TYPE_1.value]= -9
-    driver[Places.ROAD_TYPE_2.value]= -6
-    driver[Places.ROAD_TYPE_3.value]= -3
-    driver[Places.ROAD_TYPE_4.value]= 15
-    driver[Places.ROAD_TYPE_5.value]= 10
-    driver[Places.ROAD_TYPE_6.value]= 5
-    driver[Places.ROAD_TYPE_7.value]= 1
-    driver[Places.AVG_SPEED.value] = 2
-    driver[Places.AVG_SPEED.value] = 5
-    driver[Places.UNQ_ROUTES.value]= 1
-    driver[Places.STOP_COUNT.value]= 1
-    driver[Places.PED_ROAD_COUNT.value]= 3
-    driver[Places.SHOP.value]= 5
-    driver[Places.HOSPITAL.value]= 8
-    driver[Places.DOM_COV_TYPE_IS_ASH.value]=20
-
-
-    walker = default.copy()
-    walker[Places.ROAD_TYPE_1.value]= -20
-    walker[Places.ROAD_TYPE_2.value]= -15
-    walker[Places.ROAD_TYPE_3.value]= -10
-    walker[Places.ROAD_TYPE_4.value]= 5
-    walker[Places.ROAD_TYPE_5.value]= 5
-    walker[Places.ROAD_TYPE_6.value]= 5
-    walker[Places.ROAD_TYPE_7.value]= 1
-    walker[Places.ROAD_TYPE_8.value]= 0
-    walker[Places.ROAD_TYPE_9.value]= 10
-    walker[Places.PARK.value]=20
-    walker[Places.PED_ROAD_COUNT.value]= 40
-    walker[Places.SHOP.value]= 25
-    walker[Places.HOSPITAL.value]= 25
-
-
-    uses_public_transport = default.copy()
-    uses_public_transport[Places.STOP_COUNT.value] = 20
-    uses_public_transport[Places.UNQ_ROUTES.value] = 30
-
-
-    parent = default.copy()
-    parent[Places.UNQ_ROUTES.value]= 15
-    parent[Places.STOP_COUNT.value]= 15
-    parent[Places.PED_ROAD_COUNT.value]= 10
-    parent[Places.PARK.value]=25
-    parent[Places.SHOP.value]= 25
-    parent[Places.HOSPITAL.value]= 25
-    parent[Places.SCHOOL.value]= 25
-    parent[Places.FACTORIES.value]= -20
-
-
-    pet_owner = default.copy()
-    pet_owner[Places.UNQ_ROUTES.value]= 15
-    pet_owner[Places.STOP_COUNT.value]= 15
-    pet_owner[Places.PED_ROAD_COUNT.value]= 10
-    pet_owner[Places.SHOP.value]= 25
-    pet_owner[Places.PARK.value]=30
-    pet_owner[Places.HOSPITAL.value]= 25
-
-
-    big_family = default.copy()
-    big_family[Places.SHOP.value]=35
-    big_family[Places.PARK.value]=30
-    big_family[Places.HOSPITAL.value]= 25
-
-
-
-    old_family = default.copy()
-    old_family[Places.PARK.value]=35
-    old_family[Places.HOSPITAL.value]= 45
-    old_family[Places.FACTORIES.value]= -25
-
-    if builder_flg:
-        rati = builder.copy()
-    else:
-        if driver_flg:
-            rati=driver.copy()
+    values[Places.ROAD_TYPE_9.value] = hexagon["count_road_type_9"]
+
+    values[Places.AVG_SPEED.value] = hexagon["avg_speed"]
+    values[Places.AVG_LIMIT.value] = hexagon["avg_limit"]
+    values[Places.STOP_COUNT.value] = hexagon["stop_count"]
+    values[Places.UNQ_ROUTES.value] = hexagon["unique_routes_count"]
+    values[Places.PED_ROAD_COUNT.value] = hexagon["pedestrian_roads_count"]
+    values[Places.DOM_COV_TYPE_IS_ASH.value] = hexagon["dominant_coverage_type"] == "Асфальт"
+    values[Places.PARK.value] = hexagon["count_parks"]
+    values[Places.SCHOOL.value] = hexagon["count_schools"]
+    values[Places.HOSPITAL.value] = hexagon["count_hospitals"]
+    values[Places.SHOP.value] = hexagon["count_shops"]
+    values[Places.FACTORIES.value] = hexagon["count_factories"]
+
+    # NULL columns count as zero, same as in the rating engine
+    return [value or 0 for value in values]
+
+def rating_context_query(idx):
+    """Hexagon idx and all its neighbours in a single query."""
+    # ids_json (registered on every connection) unpacks the neighbour_ids blob for json_each
+    neighbours = select(HexagonData.neighbour_ids).where(HexagonData.hex_id == idx).scalar_subquery()
+    neighbour_ids = func.json_each(func.ids_json(neighbours)).table_valued("value")
+    return select(*RATING_COLUMNS).where(or_(
+        HexagonData.hex_id == idx,
+        HexagonData.hex_id.in_(select(neighbour_ids.c.value)),
+    ))
+
+def rating_context_from_rows(idx, rows):
+    values = None
+    neighbour_values = []
+    for row in rows:
+        if int(row.hex_id) == idx:
+            values = feature_values(row._mapping)
         else:
-            rati=walker.copy()
-
-        if uses_public_transport_flg:
-
-            for i in range(len(uses_public_transport)):
-                if rati[i]>=0:
-                    rati[i]=max(uses_public_transport[i],rati[i])
-                else:
-                    rati[i] = min(uses_public_transport[i], rati[i])
-
-        if parent_flg:
-
-            for i in range(len(parent)):
-                if rati[i]>=0:
-                    rati[i]=max(parent[i],rati[i])
-                else:
-                    rati[i] = min(parent[i], rati[i])
-
-        if pet_owner_flg:
-
-            for i in range(len(pet_owner)):
-                if rati[i] >= 0:
-                    rati[i] = max(pet_owner[i], rati[i])
-                else:
-                    rati[i] = min(pet_owner[i], rati[i])
-
-        if big_family_flg:
-
-            for i in range(len(big_family)):
-                if rati[i] >= 0:
-                    rati[i] = max(big_family[i], rati[i])
-                else:
-                    rati[i] = min(big_family[i], rati[i])
+            neighbour_values.append(feature_values(row._mapping))
+    if values is None:
+        return None
+    return RatingContext(idx, values, neighbour_values)
+
+def load_rating_context(db: Session, idx):
+    """Rating context of idx read from the database, or None if idx is unknown."""
+    return rating_context_from_rows(idx, db.execute(rating_context_query(idx)).all())
+
+async def load_rating_context_async(db: AsyncSession, idx):
+    """load_rating_context over an AsyncSession."""
+    result = await db.execute(rating_context_query(idx))
+    return rating_context_from_rows(idx, result.all())
+
+def rating_contexts_query(ids):
+    """Hexagons ids, all their neighbours and the neighbour list of each, in a single query."""
+    targets = aliased(HexagonData)
+    neighbour_ids = func.json_each(func.ids_json(targets.neighbour_ids)).table_valued("value")
+    return select(*RATING_COLUMNS, HexagonData.neighbour_ids).where(or_(
+        HexagonData.hex_id.in_(ids),
+        HexagonData.hex_id.in_(select(neighbour_ids.c.value).select_from(targets).join(neighbour_ids, true())
+                                 .where(targets.hex_id.in_(ids))),
+    ))
+
+def rating_contexts_from_rows(ids, rows):
+    """{hex_id: RatingContext} for each of ids among rows; unknown ids are left out."""
+    values = {}
+    listed = {}
+    for row in rows:
+        values[int(row.hex_id)] = feature_values(row._mapping)
+        listed[int(row.hex_id)] = row.neighbour_ids
+    contexts = {}
+    for idx in ids:
+        if idx not in values or idx in contexts:
+            continue
+        # In hex_id order, as rating_context_query returns them, so the sums match to the last bit
+        neighbours = {int(neig) for neig in codec.unpack_ids(listed[idx] or b"")}
+        neighbours = sorted(neig for neig in neighbours if neig in values and neig != idx)
+        contexts[idx] = RatingContext(idx, values[idx], [values[neig] for neig in neighbours])
+    return contexts
+
+def load_rating_contexts(db: Session, ids):
+    """load_rating_context of many hexagons, read with one query."""
+    return rating_contexts_from_rows(ids, db.execute(rating_contexts_query(ids)).all())
+
+async def load_rating_contexts_async(db: AsyncSession, ids):
+    """load_rating_contexts over an AsyncSession."""
+    result = await db.execute(rating_contexts_query(ids))
+    return rating_contexts_from_rows(ids, result.all())
+
+def store_rating_context(store, idx):
+    """Same context as load_rating_context, read from the in-memory store."""
+    store = store.state
+    hexagon = store.get(idx, RATING_NAMES)
+    if hexagon is None:
+        return None
+    neighbours = (store.get(int(neig), RATING_NAMES) for neig in get_neighbors(idx, store))
+    return RatingContext(
+        idx,
+        feature_values(hexagon),
+        [feature_values(neig) for neig in neighbours if neig is not None],
+    )
+
+@span("calc_rating")
+def calc_rating(values, builder_flg, driver_flg, 
+                uses_public_transport_flg, parent_flg, 
+                pet_owner_flg, big_family_flg, old_family_flg):
 
-        if old_family_flg:
+    rati = calc_weights(builder_flg, driver_flg,
+                        uses_public_transport_flg, parent_flg,
+                        pet_owner_flg, big_family_flg, old_family_flg)
 
-            for i in range(len(old_family)):
-                if rati[i] >= 0:
-                    rati[i] = max(old_family[i], rati[i])
-                else:
-                    rati[i] = min(old_family[i], rati[i])
-            
     rating = 0                
     for i in range(len(values)):
         rating += values[i]*rati[i]    
 
     return rating, values, rati
 
-def calc_finaly_rating(idx, builder_flg, driver_flg, 
+@span("calc_finaly_rating")
+def calc_finaly_rating(context: RatingContext, builder_flg, driver_flg, 
                         uses_public_transport_flg, parent_flg, 
-                        pet_owner_flg, big_family_flg, old_family_flg,
-                        db: Session):
-
-    neighbors = get_neighbors(idx, db)
-    hexagon = db.query(HexagonData).filter(HexagonData.hex_id == idx).first()
+                        pet_owner_flg, big_family_flg, old_family_flg):
 
-    rating, values, rati = calc_rating(idx, builder_flg,driver_flg,
+    rating, values, rati = calc_rating(context.values, builder_flg,driver_flg,
                                 uses_public_transport_flg,parent_flg,
-                                pet_owner_flg,big_family_flg,old_family_flg, db)
+                                pet_owner_flg,big_family_flg,old_family_flg)
 
-    for neig in neighbors:
-        neig_rate, neig_values, neig_rati = calc_rating(neig, builder_flg, driver_flg,
+    for neig_values in context.neighbour_values:
+        neig_rate, neig_values, neig_rati = calc_rating(neig_values, builder_flg, driver_flg,
                                                 uses_public_transport_flg, parent_flg,
-                                                pet_owner_flg, big_family_flg, old_family_flg,
-                                                db)
+                                                pet_owner_flg, big_family_flg, old_family_flg)
         for i in range(len(values)):
             rating += neighbor_effect[i]*neig_values[i]*neig_rati[i]
 
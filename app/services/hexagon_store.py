@@ -0,0 +1,290 @@
+import threading
+import time
+import uuid
+import numpy as np
+from sqlalchemy import Float, Integer
+from sqlalchemy.orm import Session
+from models import codec
+from models.hexagon import HexagonData
+
+
+# API column -> (packed model column, store attribute, unpack, JSON encoder)
+PACKED_COLUMNS = {
+    "peaks_json": ("peaks", "peaks", codec.unpack_peaks, codec.peaks_to_json),
+    "roads_list_json": ("road_ids", "roads", codec.unpack_road_ids, codec.road_ids_to_json),
+    "neighbours": ("neighbour_ids", "neighbour_ids", codec.unpack_ids, codec.ids_to_json),
+}
+_API_NAMES = {source: name for name, (source, *_) in PACKED_COLUMNS.items()}
+# Columns as named by the API schemas, in table order
+COLUMNS = [_API_NAMES.get(column.name, column.name) for column in HexagonData.__table__.columns if column.name != "hex_id"]
+SOURCES = {name: PACKED_COLUMNS[name][0] if name in PACKED_COLUMNS else name for name in COLUMNS}
+NUMERIC_COLUMNS = {
+    column.name: np.float64 if isinstance(column.type, Float) else np.int64
+    for column in HexagonData.__table__.columns
+    if isinstance(column.type, (Float, Integer)) and column.name != "hex_id"
+}
+TEXT_COLUMNS = [name for name in COLUMNS if name not in NUMERIC_COLUMNS and name not in PACKED_COLUMNS]
+
+
+def _unpack(name, blob):
+    return PACKED_COLUMNS[name][2](blob or b"")
+
+
+def _build_columns(rows):
+    """(columns, nulls, decoded) laid out as in StoreState from ``{column: value}`` rows."""
+    columns = {}
+    nulls = {}
+    for name, dtype in NUMERIC_COLUMNS.items():
+        raw = [row[name] for row in rows]
+        nulls[name] = np.array([value is None for value in raw], dtype=bool)
+        columns[name] = np.array([0 if value is None else value for value in raw], dtype=dtype)
+    for name in TEXT_COLUMNS:
+        columns[name] = np.empty(len(rows), dtype=object)
+        columns[name][:] = [row[name] for row in rows]
+    decoded = {}
+    for name, (_, attr, _, _) in PACKED_COLUMNS.items():
+        nulls[name] = np.array([row[name] is None for row in rows], dtype=bool)
+        decoded[attr] = [_unpack(name, row[name]) for row in rows]
+    return columns, nulls, decoded
+
+
+def _assign(columns, nulls, decoded, row, name, value):
+    """Set one cell of the (writable) arrays of a state being built."""
+    if name in nulls:
+        nulls[name][row] = value is None
+    if name in NUMERIC_COLUMNS:
+        columns[name][row] = 0 if value is None else value
+    elif name in PACKED_COLUMNS:
+        decoded[PACKED_COLUMNS[name][1]][row] = _unpack(name, value)
+    else:
+        columns[name][row] = value
+
+
+class StoreState:
+    """One version of the store's data, never modified once published.
+
+    Numeric columns are NumPy arrays (with a null mask each), text columns are
+    object arrays, and the packed peaks/roads/neighbour columns are kept as
+    NumPy views over their blobs (see models.codec); their JSON text is only
+    produced when a row is materialized for the API. ``row_of`` maps a hex_id
+    straight to its row.
+
+    ``version`` counts the changes, ``revision`` names the data being served
+    and ``modified_at`` is when it last changed; the last two feed the HTTP
+    validators (ETag / Last-Modified). ``state`` is the state itself, so code
+    that takes ``store.state`` once accepts a state as well as the store.
+    """
+
+    def __init__(self, hex_ids, columns, nulls, decoded, version=0, revision=None, modified_at=None, loaded=False):
+        row_of = np.full(int(hex_ids.max()) + 1 if len(hex_ids) else 0, -1, dtype=np.int64)
+        row_of[hex_ids] = np.arange(len(hex_ids))
+        self.hex_ids = hex_ids
+        self.row_of = row_of
+        self.columns = columns
+        self.nulls = nulls
+        self.peaks = decoded["peaks"]
+        self.roads = decoded["roads"]
+        self.neighbour_ids = decoded["neighbour_ids"]
+        self.version = version
+        self.revision = revision
+        self.modified_at = modified_at
+        self.loaded = loaded
+
+    @property
+    def state(self):
+        return self
+
+    def __len__(self):
+        return len(self.hex_ids)
+
+    def row_index(self, hex_id):
+        if 0 <= hex_id < len(self.row_of):
+            row = int(self.row_of[hex_id])
+            if row >= 0:
+                return row
+        return None
+
+    def value(self, row, name):
+        """Plain Python value of one cell (JSON text for packed columns), None for NULL."""
+        if name in self.nulls and self.nulls[name][row]:
+            return None
+        if name in PACKED_COLUMNS:
+            _, attr, _, to_json = PACKED_COLUMNS[name]
+            return to_json(getattr(self, attr)[row])
+        value = self.columns[name][row]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def row(self, row, names=COLUMNS):
+        """Materialize one row as a dict shaped like schemas.Hexagon, or just the given columns."""
+        data = {"hex_id": int(self.hex_ids[row])}
+        for name in names:
+            data[name] = self.value(row, name)
+        return data
+
+    def get(self, hex_id, names=COLUMNS):
+        row = self.row_index(hex_id)
+        return None if row is None else self.row(row, names)
+
+    def page(self, skip, limit, names=COLUMNS):
+        return [self.row(row, names) for row in self.page_rows(skip, limit).tolist()]
+
+    def page_rows(self, skip, limit):
+        """Row numbers of an offset page."""
+        return np.arange(max(skip, 0), min(max(skip, 0) + max(limit, 0), len(self)))
+
+    def page_after(self, after, limit, names=COLUMNS):
+        """Keyset page: up to limit rows with hex_id > after, in hex_id order."""
+        return [self.row(row, names) for row in self.page_after_rows(after, limit).tolist()]
+
+    def page_after_rows(self, after, limit):
+        """Row numbers of the keyset page after ``after``."""
+        start = max(after + 1, 0)
+        hex_ids = np.flatnonzero(self.row_of[start:] >= 0)[:max(limit, 0)] + start
+        return self.row_of[hex_ids]
+
+    def neighbours(self, hex_id):
+        row = self.row_index(hex_id)
+        return [] if row is None else self.neighbour_ids[row]
+
+    def in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """Row mask of hexagons whose centre lies inside the box."""
+        lon = self.columns["center_lon"]
+        lat = self.columns["center_lat"]
+        return (
+            ~self.nulls["center_lon"] & ~self.nulls["center_lat"]
+            & (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+        )
+
+    def listed_by(self, hex_id):
+        """hex_ids of the hexagons that list hex_id among their neighbours."""
+        return self.listed_by_any([hex_id])
+
+    def listed_by_any(self, hex_ids):
+        """hex_ids of the hexagons that list any of hex_ids among their neighbours."""
+        hex_ids = np.asarray(list(hex_ids), dtype=np.int64)
+        return [int(self.hex_ids[row]) for row, ids in enumerate(self.neighbour_ids) if np.isin(ids, hex_ids).any()]
+
+
+class HexagonStore:
+    """Read-mostly columnar copy of hexagonal_data kept in process memory.
+
+    The data is held in one StoreState, ``state``. Writes go to the database
+    first and are then applied here through ``upsert``/``remove``, each
+    building the next state (copy on write) and publishing it with a single
+    assignment, one ``version`` later. Reads (``store.columns``,
+    ``store.row_index(...)``, ...) go to the state published last; a reader
+    making several of them takes ``store.state`` once and uses only that, so
+    a concurrent write cannot pair rows of one version with columns of
+    another.
+
+    Data loaded or written in this process gets a ``revision`` named after the
+    process and ``version``, data replaced from a shared snapshot one named
+    after the snapshot, so every worker serving it gives the same revision.
+    """
+
+    def __init__(self):
+        self._token = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self.state = StoreState(np.zeros(0, dtype=np.int64), *_build_columns([]))
+
+    def __getattr__(self, name):
+        if name == "state":
+            raise AttributeError(name)
+        return getattr(self.state, name)
+
+    def __len__(self):
+        return len(self.state)
+
+    def _publish(self, hex_ids, columns, nulls, decoded, revision=None, modified_at=None):
+        version = self.state.version + 1
+        state = self.state = StoreState(
+            hex_ids, columns, nulls, decoded, version,
+            revision or f"{self._token}.{version}", modified_at or time.time(), loaded=True,
+        )
+        return state
+
+    def load(self, db: Session):
+        hexagons = db.query(HexagonData).all()
+        with self._lock:
+            self._publish(
+                np.asarray([int(h.hex_id) for h in hexagons], dtype=np.int64),
+                *_build_columns([{name: getattr(h, SOURCES[name]) for name in COLUMNS} for h in hexagons]),
+            )
+
+    def replace(self, hex_ids, columns, nulls, decoded, expected_version=None, revision=None, modified_at=None):
+        """Swap in a complete dataset laid out as in StoreState (e.g. an attached snapshot).
+
+        Returns the published state. With ``expected_version`` nothing happens
+        (and None is returned) if the store was written since, so such a write
+        is never lost.
+        """
+        with self._lock:
+            if expected_version is not None and self.state.version != expected_version:
+                return None
+            return self._publish(hex_ids, columns, nulls, decoded, revision, modified_at)
+
+    def upsert(self, hexagon):
+        """Apply a committed HexagonData row, updating in place when it exists."""
+        self.upsert_many([hexagon])
+
+    def upsert_many(self, hexagons):
+        """Apply committed HexagonData rows as one change (a single version bump)."""
+        with self._lock:
+            state = self.state
+            # Copies, so readers of the published state never see a half-applied write
+            # (snapshot columns are read-only memory maps anyway)
+            columns = {name: column.copy() for name, column in state.columns.items()}
+            nulls = {name: mask.copy() for name, mask in state.nulls.items()}
+            decoded = {attr: list(getattr(state, attr)) for _, attr, _, _ in PACKED_COLUMNS.values()}
+            appended = {}
+            for hexagon in hexagons:
+                hex_id = int(hexagon.hex_id)
+                values = {name: getattr(hexagon, SOURCES[name]) for name in COLUMNS}
+                row = state.row_index(hex_id)
+                if row is None:
+                    appended[hex_id] = values
+                else:
+                    for name in COLUMNS:
+                        _assign(columns, nulls, decoded, row, name, values[name])
+            hex_ids = state.hex_ids
+            if appended:
+                new_columns, new_nulls, new_decoded = _build_columns(list(appended.values()))
+                hex_ids = np.append(hex_ids, list(appended))
+                columns = {name: np.concatenate([columns[name], column]) for name, column in new_columns.items()}
+                nulls = {name: np.concatenate([nulls[name], mask]) for name, mask in new_nulls.items()}
+                decoded = {attr: decoded[attr] + values for attr, values in new_decoded.items()}
+            self._publish(hex_ids, columns, nulls, decoded)
+
+    def remove(self, hex_id):
+        self.remove_many([hex_id])
+
+    def remove_many(self, hex_ids):
+        with self._lock:
+            state = self.state
+            rows = [row for row in map(state.row_index, hex_ids) if row is not None]
+            if not rows:
+                return
+            keep = np.ones(len(state), dtype=bool)
+            keep[rows] = False
+            kept = np.flatnonzero(keep).tolist()
+            self._publish(
+                state.hex_ids[keep],
+                {name: column[keep] for name, column in state.columns.items()},
+                {name: mask[keep] for name, mask in state.nulls.items()},
+                {attr: [getattr(state, attr)[row] for row in kept] for _, attr, _, _ in PACKED_COLUMNS.values()},
+            )
+
+
+hexagon_store = HexagonStore()
+# Held around a lazy first load, so concurrent first requests load once (load takes
+# the store's own lock to publish)
+_load_lock = threading.Lock()
+
+
+def get_hexagon_store(db: Session):
+    """The shared store, loaded from ``db`` if startup has not done it yet."""
+    if not hexagon_store.loaded:
+        with _load_lock:
+            if not hexagon_store.loaded:
+                hexagon_store.load(db)
+    return hexagon_store
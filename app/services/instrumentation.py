@@ -0,0 +1,213 @@
+import bisect
+import functools
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+
+
+# Upper bounds (seconds) of the latency histogram buckets, Prometheus style
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+
+class RequestStats:
+    """SQL work done on behalf of one request, across the threads serving it."""
+
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+current_request = ContextVar("current_request", default=None)
+
+
+class Metrics:
+    """In-process metrics, rendered in the Prometheus text format.
+
+    ``requests`` holds a latency histogram per (method, route, status),
+    ``spans`` one per named span, and ``db`` the SQL statement count and time
+    per route (``""`` for work outside any request).
+
+    Spans are recorded on hot paths, so each thread keeps its own span
+    histograms and takes the lock only once, to register them; ``spans``
+    merges them when read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._span_shards = []
+        self.requests = {}
+        self.db = {}
+
+    @property
+    def spans(self):
+        with self._lock:
+            shards = list(self._span_shards)
+        merged = {}
+        for shard in shards:
+            # list() copies the items in one step, so a thread adding a span meanwhile is harmless
+            for name, histogram in list(shard.items()):
+                merged.setdefault(name, Histogram()).merge(histogram)
+        return merged
+
+    def observe_request(self, method, route, status, seconds, stats):
+        with self._lock:
+            self.requests.setdefault((method, route, status), Histogram()).observe(seconds)
+            totals = self.db.setdefault(route, [0, 0.0])
+            totals[0] += stats.queries
+            totals[1] += stats.db_time
+
+    def observe_query(self, seconds):
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += seconds
+            return
+        with self._lock:
+            totals = self.db.setdefault("", [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def observe_span(self, name, seconds):
+        shard = getattr(self._local, "spans", None)
+        if shard is None:
+            shard = self._local.spans = {}
+            with self._lock:
+                self._span_shards.append(shard)
+        histogram = shard.get(name)
+        if histogram is None:
+            histogram = shard[name] = Histogram()
+        histogram.observe(seconds)
+
+    def render(self):
+        lines = []
+        spans = self.spans
+        with self._lock:
+            _render_histograms(
+                lines, "http_request_duration_seconds", "Request latency by route",
+                {(("method", m), ("route", r), ("status", str(s))): h for (m, r, s), h in self.requests.items()},
+            )
+            _render_histograms(
+                lines, "span_duration_seconds", "Duration of named code spans",
+                {(("span", name),): h for name, h in spans.items()},
+            )
+            lines.append("# HELP db_queries_total SQL statements executed, by route")
+            lines.append("# TYPE db_queries_total counter")
+            for route, (queries, _) in sorted(self.db.items()):
+                lines.append(f'db_queries_total{{route="{route}"}} {queries}')
+            lines.append("# HELP db_query_seconds_total Time spent executing SQL, by route")
+            lines.append("# TYPE db_query_seconds_total counter")
+            for route, (_, seconds) in sorted(self.db.items()):
+                lines.append(f'db_query_seconds_total{{route="{route}"}} {seconds!r}')
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    return ",".join(f'{name}="{value}"' for name, value in pairs)
+
+
+def _render_histograms(lines, name, help_text, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for pairs, histogram in sorted(histograms.items()):
+        labels = _labels(pairs)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+metrics = Metrics()
+
+
+def span(name):
+    """Decorator recording the wrapped function's duration as a named span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe_span(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def instrument_engine(engine):
+    """Count and time every statement executed through a (sync) engine."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics.observe_query(time.perf_counter() - conn.info["query_start"].pop())
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware timing each request and reporting its SQL work.
+
+    Latency goes to ``metrics`` under the matched route template; the query
+    count and DB time are also returned in the X-DB-Queries and X-DB-Time-Ms
+    response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def route_of(self, scope):
+        # The router stores the matched endpoint in the scope
+        if self._routes is None:
+            self._routes = {route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "<unmatched>")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(stats.queries).encode()))
+                headers.append((b"x-db-time-ms", f"{stats.db_time * 1000:.3f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_request.reset(token)
+            metrics.observe_request(scope["method"], self.route_of(scope), status, time.perf_counter() - start, stats)
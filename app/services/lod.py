@@ -0,0 +1,204 @@
+import math
+import numpy as np
+from services.fast_json import float_list
+from services.hexagon_store import NUMERIC_COLUMNS, TEXT_COLUMNS
+from services.spatial import get_hexagon_index
+
+# Cell radius ratio between consecutive levels: each level has about a quarter
+# of the cells of the one below
+LEVEL_SCALE = 2
+# Coarser levels are added until one has at most this many cells
+MIN_CELLS = 8
+MAX_LEVELS = 16
+# With a zoom, cells narrower than this many screen pixels are too fine to show
+MIN_CELL_PX = 12
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320
+EARTH_CIRCUMFERENCE_KM = 40075.017
+# Per-hexagon averages are averaged over a cell, every other numeric column summed
+MEAN_COLUMNS = ("avg_speed", "avg_limit")
+SUM_COLUMNS = tuple(
+    name for name, dtype in NUMERIC_COLUMNS.items() if dtype is np.int64 and name not in MEAN_COLUMNS
+)
+_SQRT3 = math.sqrt(3)
+
+
+def _hex_round(q, r):
+    """Nearest hexagon (axial q, r) to fractional axial coordinates, by cube rounding."""
+    s = -q - r
+    rq, rr, rs = np.rint(q), np.rint(r), np.rint(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+class LodLevel:
+    """One pyramid level: cells, which hexagon rows each one covers, and their aggregated columns.
+
+    ``members`` holds the store rows that have a position and ``cell_of`` the
+    cell index of each. Level 0 has one cell per hexagon (``cell_ids`` are the
+    hex_ids and the polygons the hexagon peaks); coarser levels are hexagonal
+    bins of radius ``radius_km`` with ids numbered within the level.
+    """
+
+    def __init__(self, store, text, radius_km, members, cell_of, cell_ids, centers, polygons, min_xy, max_xy):
+        self.radius_km = radius_km
+        self.members = members
+        self.cell_of = cell_of
+        self.cell_ids = cell_ids
+        self.centers = centers
+        self.polygons = polygons
+        self.min_xy = min_xy
+        self.max_xy = max_xy
+        m = len(cell_ids)
+        self.hexagons = np.bincount(cell_of, minlength=m)
+        self.sums = {}
+        for name in SUM_COLUMNS:
+            # NULL is stored as 0, so it adds nothing
+            self.sums[name] = np.bincount(cell_of, weights=store.columns[name][members], minlength=m).astype(np.int64)
+        self.means = {}
+        for name in MEAN_COLUMNS:
+            present = ~store.nulls[name][members]
+            total = np.bincount(cell_of, weights=np.where(present, store.columns[name][members], 0.0), minlength=m)
+            count = np.bincount(cell_of, weights=present, minlength=m)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.means[name] = np.where(count > 0, total / count, np.nan)
+        self.modes = {}
+        for name, (present, coded) in text.items():
+            # Code len(present) stands for NULL and never wins
+            k = len(present) + 1
+            counts = np.bincount(cell_of * k + coded, minlength=m * k).reshape(m, k)[:, :-1]
+            best = counts.argmax(axis=1) if len(present) else np.zeros(m, dtype=np.int64)
+            found = counts[np.arange(m), best] > 0 if len(present) else np.zeros(m, dtype=bool)
+            self.modes[name] = [present[code] if hit else None for code, hit in zip(best.tolist(), found.tolist())]
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    def overlapping(self, min_lon, min_lat, max_lon, max_lat):
+        """Cells whose polygon bounding box overlaps the box."""
+        return np.flatnonzero(
+            (self.max_xy[:, 0] >= min_lon) & (self.min_xy[:, 0] <= max_lon)
+            & (self.max_xy[:, 1] >= min_lat) & (self.min_xy[:, 1] <= max_lat)
+        )
+
+    def cells(self, cells, ratings=None):
+        """JSON-ready dicts of the given cells; ``rating`` is the mean of ``ratings`` (store order) over each."""
+        cells = np.asarray(cells, dtype=np.int64)
+        columns = {
+            "cell_id": self.cell_ids[cells].tolist(),
+            "hexagons": self.hexagons[cells].tolist(),
+            "center_lon": float_list(self.centers[cells, 0]),
+            "center_lat": float_list(self.centers[cells, 1]),
+            "peaks": [np.asarray(self.polygons[cell])[:, :2].tolist() for cell in cells.tolist()],
+        }
+        for name, values in self.sums.items():
+            columns[name] = values[cells].tolist()
+        for name, values in self.means.items():
+            means = values[cells]
+            columns[name] = float_list(np.nan_to_num(means))
+            for i in np.flatnonzero(np.isnan(means)).tolist():
+                columns[name][i] = None
+        for name, values in self.modes.items():
+            columns[name] = [values[cell] for cell in cells.tolist()]
+        if ratings is not None:
+            total = np.bincount(self.cell_of, weights=ratings[self.members], minlength=len(self))
+            columns["rating"] = float_list(total[cells] / np.maximum(self.hexagons[cells], 1))
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+class LodPyramid:
+    """Level-of-detail pyramid over the hexagon grid, for zoomed-out views.
+
+    Level 0 is the grid itself. Each coarser level bins the hexagons, by
+    position, into pointy-top hexagonal cells ``LEVEL_SCALE`` times wider
+    than the level below (laid out in a local equirectangular projection in
+    km), summing the count columns, averaging the per-hexagon averages and
+    taking the most common text value. Levels are added until one has at
+    most ``MIN_CELLS`` cells.
+    """
+
+    def __init__(self, store, index, version=0):
+        self.version = version
+        valid = index.valid
+        # A hexagon sits at its polygon's bbox centre, else at its centre columns when it has none
+        points = (index.min_xy + index.max_xy) / 2
+        has_center = ~(store.nulls["center_lon"] | store.nulls["center_lat"])
+        points[~valid] = np.stack([store.columns["center_lon"], store.columns["center_lat"]], axis=1)[~valid]
+        members = np.flatnonzero(valid | has_center)
+        points = points[members]
+
+        origin = (points.min(axis=0) + points.max(axis=0)) / 2 if len(points) else np.zeros(2)
+        self.origin = origin
+        self.scale = np.array([KM_PER_DEGREE_LON * math.cos(math.radians(origin[1])), KM_PER_DEGREE_LAT])
+        xy = (points - origin) * self.scale
+        # Circumradius of the base hexagons: median centre to farthest peak
+        rings = (index.vertices[members] - origin) * self.scale
+        reach = np.linalg.norm(rings - xy[:, None, :], axis=2).max(axis=1)
+        base_radius = float(np.median(reach[valid[members]])) if valid[members].any() else 1.0
+        self._text = {}
+        for name in TEXT_COLUMNS:
+            values = store.columns[name][members]
+            present = sorted({value for value in values if value is not None})
+            codes = {value: code for code, value in enumerate(present)}
+            self._text[name] = (present, np.array([codes.get(value, len(present)) for value in values], dtype=np.int64))
+
+        self.levels = [LodLevel(
+            store, self._text, base_radius, members, np.arange(len(members)), store.hex_ids[members], points,
+            [store.peaks[row] if valid[row] else np.asarray([point]) for row, point in zip(members.tolist(), points)],
+            np.where(valid[members, None], index.min_xy[members], points),
+            np.where(valid[members, None], index.max_xy[members], points),
+        )]
+        while len(self.levels[-1]) > MIN_CELLS and len(self.levels) < MAX_LEVELS:
+            self.levels.append(self._bin(store, members, xy, base_radius * LEVEL_SCALE ** len(self.levels)))
+
+    def _bin(self, store, members, xy, radius):
+        q, r = _hex_round((_SQRT3 / 3 * xy[:, 0] - xy[:, 1] / 3) / radius, (2 / 3 * xy[:, 1]) / radius)
+        # One integer key per (r, q), row-major, so cells come out ordered south to north
+        r0, q0 = r.min(), q.min()
+        width = int(q.max() - q0) + 1
+        keys, cell_of = np.unique((r - r0) * width + (q - q0), return_inverse=True)
+        r, q = keys // width + r0, keys % width + q0
+        centers = np.stack([radius * _SQRT3 * (q + r / 2), radius * 1.5 * r], axis=1)
+        angles = np.radians(30 + 60 * np.arange(6))
+        corners = centers[:, None, :] + radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        corners = corners / self.scale + self.origin
+        return LodLevel(
+            store, self._text, radius, members, cell_of.reshape(-1), np.arange(len(keys)),
+            centers / self.scale + self.origin, corners, corners.min(axis=1), corners.max(axis=1),
+        )
+
+    @classmethod
+    def from_store(cls, store):
+        state = store.state
+        return cls(state, get_hexagon_index(state), state.version)
+
+    def select(self, bbox, max_cells, zoom=None):
+        """Finest level showing at most max_cells cells in bbox (and, with a zoom, no cell under MIN_CELL_PX)."""
+        finest = 0
+        if zoom is not None:
+            km_per_px = EARTH_CIRCUMFERENCE_KM * math.cos(math.radians(self.origin[1])) / (256 * 2 ** zoom)
+            while finest < len(self.levels) - 1 and _SQRT3 * self.levels[finest].radius_km < MIN_CELL_PX * km_per_px:
+                finest += 1
+        for level in range(finest, len(self.levels)):
+            cells = self.levels[level].overlapping(*bbox)
+            if len(cells) <= max_cells:
+                break
+        return level, cells
+
+
+_pyramid = None
+
+
+def get_lod_pyramid(store):
+    """Pyramid over the current store data, rebuilt after any write."""
+    global _pyramid
+    pyramid = _pyramid
+    state = store.state
+    if pyramid is None or pyramid.version != state.version:
+        pyramid = _pyramid = LodPyramid.from_store(state)
+    return pyramid
@@ -0,0 +1,185 @@
+import functools
+import hmac
+import inspect
+import itertools
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from starlette.responses import JSONResponse
+from database.database import SessionRoute
+import settings
+
+
+# Profiler of the request being handled, set only for requests that asked for
+# profiling with a valid X-Profile-Token
+active_profiler = ContextVar("active_profiler", default=None)
+
+
+class StackProfiler:
+    """Deterministic profiler keeping wall time per complete call stack.
+
+    Runs through ``sys.setprofile`` in the thread executing the endpoint, so
+    it is only ever switched on for a profiled request. ``collapsed`` gives the
+    stacks in the collapsed format flamegraph tools read
+    (``frame;frame;frame microseconds`` per line). An async endpoint is
+    profiled on the event loop thread, so work of other requests interleaved
+    at its awaits is included too, and a second profiler started there would
+    replace it: ProfilingMiddleware runs one profiled request at a time.
+    """
+
+    def __init__(self):
+        self.stacks = Counter()
+        self._stack = []
+        self._last = None
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter()
+        if self._stack:
+            self.stacks[tuple(self._stack)] += now - self._last
+        if event == "call":
+            code = frame.f_code
+            self._stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        elif event == "c_call":
+            self._stack.append(getattr(arg, "__qualname__", repr(arg)))
+        elif self._stack:
+            # return, c_return, c_exception; frames entered before start are not on the stack
+            self._stack.pop()
+        self._last = time.perf_counter()
+
+    def run(self, func, *args, **kwargs):
+        self._last = time.perf_counter()
+        sys.setprofile(self._event)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+
+    async def run_async(self, func, *args, **kwargs):
+        self._last = time.perf_counter()
+        sys.setprofile(self._event)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+
+    def collapsed(self):
+        return "".join(
+            f"{';'.join(stack)} {round(seconds * 1e6)}\n"
+            for stack, seconds in self.stacks.most_common()
+        )
+
+
+def profiled(endpoint):
+    """Run endpoint under the request's profiler, if it has one."""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            profiler = active_profiler.get()
+            if profiler is None:
+                return await endpoint(*args, **kwargs)
+            return await profiler.run_async(endpoint, *args, **kwargs)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            profiler = active_profiler.get()
+            if profiler is None:
+                return endpoint(*args, **kwargs)
+            return profiler.run(endpoint, *args, **kwargs)
+    return wrapper
+
+
+class ProfiledRoute(SessionRoute):
+    """SessionRoute whose endpoint can be profiled per request (route_class of the routers)."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiled(endpoint), **kwargs)
+
+
+class ProfileBuffer:
+    """The last ``size`` request profiles, oldest dropped first."""
+
+    def __init__(self, size):
+        self._profiles = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def add(self, profile_id, method, path, seconds, profiler):
+        with self._lock:
+            self._profiles.append({
+                "id": profile_id,
+                "method": method,
+                "path": path,
+                "duration_ms": round(seconds * 1000, 3),
+                "collapsed": profiler.collapsed(),
+            })
+
+    def list(self):
+        with self._lock:
+            return [{k: v for k, v in profile.items() if k != "collapsed"} for profile in self._profiles]
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((profile for profile in self._profiles if profile["id"] == profile_id), None)
+
+
+profile_buffer = ProfileBuffer(settings.PROFILE_BUFFER_SIZE)
+
+
+def token_valid(token):
+    """True only when profiling is configured and token matches it."""
+    expected = settings.PROFILING_TOKEN
+    return bool(expected) and token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+
+class ProfilingMiddleware:
+    """Profiles requests sent with a valid X-Profile-Token header.
+
+    The collapsed stacks are kept in ``profile_buffer`` (see /admin/profiles)
+    and the response gets an X-Profile-Id header pointing at them. One request
+    is profiled at a time (see StackProfiler); another sent meanwhile gets a
+    409. Added only when settings.PROFILING_TOKEN is set; other requests just
+    pass through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._running = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = next((value.decode() for name, value in scope["headers"] if name == b"x-profile-token"), None)
+        # /admin takes the token too, to read the profiles, but has nothing to profile
+        if token is None or not token_valid(token) or scope["path"].startswith("/admin/"):
+            await self.app(scope, receive, send)
+            return
+        if not self._running.acquire(blocking=False):
+            response = JSONResponse({"detail": "Another request is being profiled"}, status_code=409)
+            await response(scope, receive, send)
+            return
+
+        profiler = StackProfiler()
+        context_token = active_profiler.set(profiler)
+        start = time.perf_counter()
+        # The id goes out with the response headers, before the profile is complete
+        profile_id = profile_buffer.next_id()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", str(profile_id).encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            active_profiler.reset(context_token)
+            self._running.release()
+            profile_buffer.add(profile_id, scope["method"], scope["path"], time.perf_counter() - start, profiler)
@@ -0,0 +1,140 @@
+import threading
+import itertools
+from collections import OrderedDict
+import numpy as np
+from services.hexagon_ratings import calc_finaly_rating, store_rating_context, weight_profiles
+from services.rating_engine import get_rating_engine
+from services.weight_profiles import canonical_flags
+
+
+# Every distinct flag combination calc_weights can tell apart (1 builder + 64 others)
+REACHABLE_FLAGS = sorted({canonical_flags(*bits) for bits in itertools.product((False, True), repeat=7)})
+
+
+class RatingCache:
+    """Final ratings of every hexagon, materialized per flag combination.
+
+    Each entry is a dense array indexed by hex_id; NaN marks a rating that is
+    missing or was invalidated by a write and gets recomputed on next access.
+    Entries are evicted least-recently-used beyond ``max_entries`` and all of
+    them are dropped when the weight profiles are reloaded.
+
+    ``version`` is the newest store version an invalidation has been seen
+    for. A reader holding an older store state (taken before a write that has
+    since invalidated here) is answered from that state but never fills the
+    cache, which would bring back ratings from before the write.
+    """
+
+    def __init__(self, max_entries=len(REACHABLE_FLAGS)):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self.version = 0
+        self._profiles_version = weight_profiles.version
+        self._lock = threading.Lock()
+
+    def _entry(self, store, flags):
+        """(entry, created) for flags; a new entry is computed for the whole grid at once."""
+        if self._profiles_version != weight_profiles.version:
+            self._entries.clear()
+            self._profiles_version = weight_profiles.version
+        entry = self._entries.get(flags)
+        if entry is not None:
+            self._entries.move_to_end(flags)
+            return entry, False
+        engine = get_rating_engine(store)
+        entry = np.full(int(store.hex_ids.max()) + 1 if len(store) else 0, np.nan)
+        entry[engine.hex_ids] = engine.rate_flags(*flags)
+        self._entries[flags] = entry
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry, True
+
+    def _refresh(self, store, entry, hex_id, flags):
+        entry[hex_id] = calc_finaly_rating(store_rating_context(store, hex_id), *flags)
+        return entry[hex_id]
+
+    def rating(self, store, hex_id, flags):
+        flags = canonical_flags(*flags)
+        store = store.state
+        with self._lock:
+            if store.version >= self.version:
+                return self._rating(store, hex_id, flags)
+            self.misses += 1
+        # Taken before a write that has invalidated here since: rated from it, never cached
+        return float(calc_finaly_rating(store_rating_context(store, hex_id), *flags))
+
+    def _rating(self, store, hex_id, flags):
+        entry, created = self._entry(store, flags)
+        if hex_id >= len(entry):
+            entry = self._entries[flags] = np.append(entry, np.full(hex_id + 1 - len(entry), np.nan))
+        value = entry[hex_id]
+        if not created and not np.isnan(value):
+            self.hits += 1
+            return float(value)
+        self.misses += 1
+        if np.isnan(value):
+            value = self._refresh(store, entry, hex_id, flags)
+        return float(value)
+
+    def ratings(self, store, flags):
+        """hex_ids and ratings of every hexagon in store order."""
+        flags = canonical_flags(*flags)
+        store = store.state
+        with self._lock:
+            if store.version >= self.version:
+                return self._ratings(store, flags)
+            self.misses += 1
+        return store.hex_ids, get_rating_engine(store).rate_flags(*flags)
+
+    def _ratings(self, store, flags):
+        entry, created = self._entry(store, flags)
+        hex_ids = store.hex_ids
+        if len(hex_ids) and hex_ids.max() >= len(entry):
+            entry = self._entries[flags] = np.append(entry, np.full(int(hex_ids.max()) + 1 - len(entry), np.nan))
+        values = entry[hex_ids]
+        stale = np.isnan(values)
+        if not created and not stale.any():
+            self.hits += 1
+            return hex_ids, values
+        self.misses += 1
+        for hex_id in hex_ids[stale].tolist():
+            self._refresh(store, entry, hex_id, flags)
+        return hex_ids, entry[hex_ids]
+
+    def warm(self, store):
+        for flags in REACHABLE_FLAGS[:self.max_entries]:
+            with self._lock:
+                self._entry(store, flags)
+
+    def invalidate(self, store, hex_id):
+        """Drop the cached ratings of hex_id and of every hexagon listing it as neighbour."""
+        self.invalidate_many(store, [hex_id])
+
+    def invalidate_many(self, store, hex_ids):
+        """invalidate for a whole batch of written hexagons in one pass."""
+        state = store.state
+        stale = np.unique(np.asarray(list(hex_ids) + state.listed_by_any(hex_ids), dtype=np.int64))
+        with self._lock:
+            self.version = max(self.version, state.version)
+            for entry in self._entries.values():
+                entry[stale[stale < len(entry)]] = np.nan
+
+    def clear(self, store=None):
+        """Drop every entry; with a store, also refuse fills from states older than it."""
+        with self._lock:
+            if store is not None:
+                self.version = max(self.version, store.state.version)
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+
+rating_cache = RatingCache()
@@ -0,0 +1,174 @@
+import threading
+import numpy as np
+from services.hexagon_ratings import Places, neighbor_effect, calc_weights
+
+
+# Column of hexagonal_data behind every Places feature (same mapping as calc_rating)
+FEATURE_COLUMNS = {
+    Places.ROAD_TYPE_1: "count_road_type_1",
+    Places.ROAD_TYPE_2: "count_road_type_2",
+    Places.ROAD_TYPE_3: "count_road_type_3",
+    Places.ROAD_TYPE_4: "count_road_type_4",
+    Places.ROAD_TYPE_5: "count_road_type_5",
+    Places.ROAD_TYPE_6: "count_road_type_6",
+    Places.ROAD_TYPE_7: "count_road_type_7",
+    Places.ROAD_TYPE_8: None,
+    Places.ROAD_TYPE_9: "count_road_type_9",
+    Places.AVG_SPEED: "avg_speed",
+    Places.AVG_LIMIT: "avg_limit",
+    Places.UNQ_ROUTES: "unique_routes_count",
+    Places.STOP_COUNT: "stop_count",
+    Places.PED_ROAD_COUNT: "pedestrian_roads_count",
+    Places.DOM_COV_TYPE_IS_ASH: "dominant_coverage_type",
+    Places.PARK: "count_parks",
+    Places.SCHOOL: "count_schools",
+    Places.FACTORIES: "count_factories",
+    Places.HOSPITAL: "count_hospitals",
+    Places.SHOP: "count_shops",
+}
+
+FEATURE_COUNT = len(Places)
+NEIGHBOR_EFFECT = np.asarray(neighbor_effect, dtype=np.float64)
+# Deepest neighbourhood ring the API accepts
+MAX_RINGS = 5
+
+
+class RatingEngine:
+    """Whole-grid rating: all hexagon features as one matrix plus a CSR neighbour graph.
+
+    For a weight vector ``w`` the rating of every hexagon is
+    ``X @ w + A @ (X @ (neighbor_effect * w))``, which is what
+    ``calc_finaly_rating`` computes one hexagon at a time.
+
+    With ``rings`` > 1 the neighbour term also counts the hexagons 2..rings
+    steps away (each once, at its shortest distance d) scaled by
+    ``decay ** (d - 1)``. Rings are found by BFS frontiers over the CSR graph,
+    expanded for all hexagons at once and kept until the engine is rebuilt.
+    """
+
+    def __init__(self, hex_ids, features, indptr, indices, version=0):
+        self.hex_ids = hex_ids
+        self.features = features
+        self.indptr = indptr
+        self.indices = indices
+        self.version = version
+        self._rows = np.repeat(np.arange(len(hex_ids)), np.diff(indptr))
+        self._rings = []
+        self._visited = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store):
+        """Engine over one state of the store (``store.state``, taken once)."""
+        store = store.state
+        n = len(store)
+        features = np.zeros((n, FEATURE_COUNT), dtype=np.float64)
+        for place, column in FEATURE_COLUMNS.items():
+            if column is None:
+                continue
+            if place is Places.DOM_COV_TYPE_IS_ASH:
+                features[:, place.value] = store.columns[column] == "Асфальт"
+            else:
+                features[:, place.value] = np.where(store.nulls[column], 0, store.columns[column])
+
+        # Neighbours missing from the table are skipped
+        indptr = [0]
+        indices = []
+        for hex_neighbours in store.neighbour_ids:
+            rows = (store.row_index(n) for n in hex_neighbours)
+            indices.extend(row for row in rows if row is not None)
+            indptr.append(len(indices))
+        return cls(store.hex_ids, features,
+                   np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64),
+                   store.version)
+
+    def __len__(self):
+        return len(self.hex_ids)
+
+    def neighbour_sum(self, values):
+        """A @ values for the CSR adjacency."""
+        return np.bincount(self._rows, weights=values[self.indices], minlength=len(self))
+
+    def ring_keys(self, rings):
+        """Sorted ``source * n + target`` row keys of rings 2..rings, one array per ring."""
+        # Rings are only appended, each one complete, so reads need the lock only
+        # while a ring they want is still to be built
+        if len(self._rings) < rings - 1:
+            with self._lock:
+                self._expand_rings(len(self), rings)
+        return self._rings[:rings - 1]
+
+    def _expand_rings(self, n, rings):
+        if self._visited is None:
+            # Distance 0 and 1: the hexagon itself and its listed neighbours
+            self._frontier = np.unique(self._rows * n + self.indices)
+            self._visited = np.union1d(np.arange(n) * (n + 1), self._frontier)
+        while len(self._rings) < rings - 1:
+            sources, targets = np.divmod(self._frontier, n)
+            counts = self.indptr[targets + 1] - self.indptr[targets]
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            reached = self.indices[np.repeat(self.indptr[targets], counts) + offsets]
+            keys = np.unique(np.repeat(sources, counts) * n + reached)
+            keys = keys[~np.isin(keys, self._visited, assume_unique=True)]
+            self._visited = np.union1d(self._visited, keys)
+            self._frontier = keys
+            self._rings.append(keys)
+
+    def rate(self, weights, rings=1, decay=1.0):
+        weights = np.asarray(weights, dtype=np.float64)
+        own = self.features @ weights
+        spill = self.features @ (NEIGHBOR_EFFECT * weights)
+        total = own + self.neighbour_sum(spill)
+        for distance, keys in enumerate(self.ring_keys(rings), start=2):
+            sources, targets = np.divmod(keys, len(self))
+            total += decay ** (distance - 1) * np.bincount(sources, weights=spill[targets], minlength=len(self))
+        return total
+
+    def rate_row(self, weights, row, rings=1, decay=1.0):
+        """rate() of a single row, touching only that row's neighbourhood."""
+        weights = np.asarray(weights, dtype=np.float64)
+        effect = NEIGHBOR_EFFECT * weights
+        total = self.features[row] @ weights
+        total += (self.features[self.indices[self.indptr[row]:self.indptr[row + 1]]] @ effect).sum()
+        n = len(self)
+        for distance, keys in enumerate(self.ring_keys(rings), start=2):
+            start, stop = np.searchsorted(keys, [row * n, (row + 1) * n])
+            total += decay ** (distance - 1) * (self.features[keys[start:stop] % n] @ effect).sum()
+        return float(total)
+
+    def rate_flags(self, builder_flg, driver_flg,
+                   uses_public_transport_flg, parent_flg,
+                   pet_owner_flg, big_family_flg, old_family_flg, rings=1, decay=1.0):
+        weights = calc_weights(builder_flg, driver_flg,
+                               uses_public_transport_flg, parent_flg,
+                               pet_owner_flg, big_family_flg, old_family_flg)
+        return self.rate(weights, rings, decay)
+
+
+def top_k(values, k, candidates=None):
+    """Indices of the k largest values, best first; argpartition keeps it O(n + k log k)."""
+    rows = np.arange(len(values)) if candidates is None else np.flatnonzero(candidates)
+    if k <= 0 or not len(rows):
+        return rows[:0]
+    if k < len(rows):
+        rows = rows[np.argpartition(-values[rows], k - 1)[:k]]
+    return rows[np.argsort(-values[rows], kind="stable")]
+
+
+_engine = None
+
+
+def get_rating_engine(store):
+    """Engine over the current store contents, rebuilt after any write."""
+    global _engine
+    engine = _engine
+    state = store.state
+    if engine is None or engine.version != state.version:
+        engine = _engine = RatingEngine.from_store(state)
+    return engine
+
+
+def set_rating_engine(engine):
+    """Use a ready-made engine (matched to the store by ``version``), e.g. from a snapshot."""
+    global _engine
+    _engine = engine
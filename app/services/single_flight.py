@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import settings
+
+
+class SingleFlight:
+    """Concurrent identical calls share one computation, whose result is then kept briefly.
+
+    ``call(key, compute)`` runs compute() unless a call with an equal key is
+    already in flight, in which case it waits for that call's result (or
+    exception) instead of starting another. Results are kept for ``ttl``
+    seconds, ``max_entries`` at most, least recently used evicted first;
+    exceptions are passed to the waiting callers but not kept. Keys should
+    carry the dataset version, so a write is never answered from before it:
+    the TTL only bounds how long a change made outside this process, straight
+    to the database, can go unseen.
+
+    In-flight calls are concurrent.futures.Future objects, so threadpool
+    callers (``call``) and event loop callers (``call_async``) can wait on
+    each other.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _claim(self, key):
+        """(cached, value, future, leader): a fresh result, else the call in flight, else a new one to run."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._results.move_to_end(key)
+                    self.hits += 1
+                    return True, value, None, False
+                del self._results[key]
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, None, future, False
+            future = self._calls[key] = Future()
+            self.misses += 1
+            return False, None, future, True
+
+    def _settle(self, key, future, value=None, error=None):
+        with self._lock:
+            del self._calls[key]
+            if error is None and self.ttl > 0:
+                self._results[key] = (time.monotonic() + self.ttl, value)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def call(self, key, compute):
+        cached, value, future, leader = self._claim(key)
+        if cached:
+            return value
+        if not leader:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, value)
+        return value
+
+    async def call_async(self, key, compute):
+        """call() with compute a coroutine function; waiting yields to the event loop."""
+        cached, value, future, leader = self._claim(key)
+        if cached:
+            return value
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            value = await compute()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "entries": len(self._results),
+            "in_flight": len(self._calls),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+
+# GET /hexagons/{id}/metrics results
+metrics_flight = SingleFlight(settings.METRICS_CACHE_TTL, settings.METRICS_CACHE_SIZE)
@@ -0,0 +1,282 @@
+import contextlib
+import fcntl
+import os
+import shutil
+import threading
+import time
+from collections.abc import Sequence
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+import settings
+from database.database import SessionLocal
+from models import codec
+from services.hexagon_ratings import weight_profiles
+from services.hexagon_store import NUMERIC_COLUMNS, PACKED_COLUMNS, TEXT_COLUMNS, HexagonStore
+from services.rating_cache import rating_cache
+from services.rating_engine import RatingEngine, set_rating_engine
+from services.spatial import HexagonIndex, set_hexagon_index
+
+
+class RaggedRows(Sequence):
+    """Per-row views into one flat array, split at ``offsets`` (row i is flat[offsets[i]:offsets[i + 1]])."""
+
+    def __init__(self, flat, offsets):
+        self.flat = flat
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return self.flat[self.offsets[row]:self.offsets[row + 1]]
+
+
+def _ragged(rows, dtype, shape=()):
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=offsets[1:])
+    flat = np.concatenate(rows) if len(rows) else np.zeros((0, *shape), dtype=dtype)
+    return flat.astype(dtype, copy=False), offsets
+
+
+def snapshot_arrays(store):
+    """Everything a worker serves from, as named arrays: store columns, rating engine and spatial index."""
+    store = store.state
+    arrays = {"hex_ids": store.hex_ids}
+    for name in NUMERIC_COLUMNS:
+        arrays[f"column.{name}"] = store.columns[name]
+    for name, mask in store.nulls.items():
+        arrays[f"null.{name}"] = mask
+    for name in TEXT_COLUMNS:
+        # Few distinct values: stored as codes into a small table, -1 for NULL
+        values = store.columns[name]
+        present = sorted({value for value in values if value is not None})
+        codes = {value: code for code, value in enumerate(present)}
+        arrays[f"text.{name}.values"] = np.array(present, dtype=str)
+        arrays[f"text.{name}.codes"] = np.array([codes.get(value, -1) for value in values], dtype=np.int32)
+    for name, (_, attr, _, _) in PACKED_COLUMNS.items():
+        rows = getattr(store, attr)
+        shape = rows[0].shape[1:] if len(rows) else ()
+        dtype = rows[0].dtype if len(rows) else codec.ID_DTYPE
+        arrays[f"packed.{attr}"], arrays[f"packed.{attr}.offsets"] = _ragged(list(rows), dtype, shape)
+    engine = RatingEngine.from_store(store)
+    arrays["engine.features"] = engine.features
+    arrays["engine.indptr"] = engine.indptr
+    arrays["engine.indices"] = engine.indices
+    for name, array in HexagonIndex.from_store(store).arrays().items():
+        arrays[f"index.{name}"] = array
+    return arrays
+
+
+class SnapshotDirectory:
+    """Immutable dataset snapshots shared by the workers of one server.
+
+    Each snapshot is a directory of ``.npy`` files named by an increasing
+    version. The ``CURRENT`` file names the one to serve and is only ever
+    swapped with an atomic rename, after the snapshot is completely written,
+    so readers see either the old or the new snapshot and never a partial
+    one. Writers take an exclusive lock on ``lock`` for the whole publish.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def current(self):
+        try:
+            with open(os.path.join(self.path, "CURRENT")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def changed_at(self):
+        """mtime of CURRENT (None when there is no snapshot), a cheap check for a new version."""
+        try:
+            return os.stat(os.path.join(self.path, "CURRENT")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @contextlib.contextmanager
+    def lock(self, shared=False):
+        with open(os.path.join(self.path, "lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def write(self, arrays):
+        """Write arrays as the next snapshot and make it current; call with the lock held."""
+        name = f"{int(self.current() or 0) + 1:08d}"
+        staging = os.path.join(self.path, f".{name}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        # With the name, tells this snapshot apart from one of the same name in a wiped directory
+        arrays = {**arrays, "created_at": np.array([time.time()])}
+        for key, array in arrays.items():
+            np.save(os.path.join(staging, f"{key}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+        os.rename(staging, os.path.join(self.path, name))
+        with open(os.path.join(self.path, "CURRENT.tmp"), "w") as f:
+            f.write(name)
+        os.replace(os.path.join(self.path, "CURRENT.tmp"), os.path.join(self.path, "CURRENT"))
+        self._prune(keep=(name,))
+        return name
+
+    def _prune(self, keep):
+        # Workers still mapping an older snapshot keep its pages until they let go
+        for entry in os.listdir(self.path):
+            if entry.isdigit() and entry not in keep:
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    def open(self, name):
+        """Arrays of snapshot name, memory-mapped copy-on-write (writes stay private to the process)."""
+        directory = os.path.join(self.path, name)
+        return {
+            entry[:-len(".npy")]: np.load(os.path.join(directory, entry), mmap_mode="c").view(np.ndarray)
+            for entry in os.listdir(directory)
+        }
+
+
+def attach(store, arrays, name, expected_version=None):
+    """Serve store, rating engine and spatial index from snapshot arrays, without copying them.
+
+    Returns the attached store state, or None, leaving everything as it
+    was, when ``expected_version`` is given and the store has been written
+    since.
+    """
+    created_at = float(arrays["created_at"][0])
+    hex_ids = arrays["hex_ids"]
+    columns = {name: arrays[f"column.{name}"] for name in NUMERIC_COLUMNS}
+    for name in TEXT_COLUMNS:
+        values = np.empty(len(arrays[f"text.{name}.values"]) + 1, dtype=object)
+        values[:-1] = arrays[f"text.{name}.values"].tolist()
+        columns[name] = values[arrays[f"text.{name}.codes"]]
+    nulls = {key[len("null."):]: array for key, array in arrays.items() if key.startswith("null.")}
+    decoded = {
+        attr: RaggedRows(arrays[f"packed.{attr}"], arrays[f"packed.{attr}.offsets"])
+        for _, attr, _, _ in PACKED_COLUMNS.values()
+    }
+    revision = f"snapshot.{name}.{created_at!r}"
+    state = store.replace(hex_ids, columns, nulls, decoded, expected_version, revision, created_at)
+    if state is None:
+        return None
+    set_rating_engine(RatingEngine(
+        hex_ids, arrays["engine.features"], arrays["engine.indptr"], arrays["engine.indices"], state.version,
+    ))
+    set_hexagon_index(HexagonIndex.from_arrays(
+        hex_ids, {name: arrays[f"index.{name}"] for name in HexagonIndex.ARRAYS if f"index.{name}" in arrays}, state.version,
+    ))
+    # Ratings were cached for the previous data; recomputed on demand from the new engine
+    rating_cache.clear(state)
+    return state
+
+
+class SnapshotSource:
+    """The snapshot this worker serves from, kept current.
+
+    ``version`` is the store version matching snapshot ``name``; a store
+    ahead of it has local writes not yet published, and is never replaced
+    by ``refresh``. ``publish`` writes such a store out: straight from the
+    store when it is still based on the current snapshot, otherwise (another
+    worker published meanwhile) from the database, which has the committed
+    writes of both.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = None
+        self.version = None
+        self._changed_at = None
+        self._lock = threading.Lock()
+
+    def _attach(self, store, name, expected_version=None):
+        state = attach(store, self.directory.open(name), name, expected_version)
+        if state is not None:
+            self.name = name
+            self.version = state.version
+        self._changed_at = self.directory.changed_at()
+
+    def load(self, store):
+        """Attach to the current snapshot, building the first one from the database if there is none."""
+        with self._lock, self.directory.lock():
+            name = self.directory.current()
+            if name is None:
+                name = self.directory.write(snapshot_arrays(load_from_db()))
+            self._attach(store, name)
+
+    def rebuild(self):
+        """Publish a new snapshot from the database, e.g. at server start; workers pick it up on their next request."""
+        with self._lock, self.directory.lock():
+            return self.directory.write(snapshot_arrays(load_from_db()))
+
+    def changed(self):
+        """Whether CURRENT changed since it was last read: a single stat, cheap enough for the event loop."""
+        return self.directory.changed_at() != self._changed_at
+
+    def refresh(self, store):
+        if not self.changed():
+            return
+        with self._lock:
+            if store.version != self.version:
+                return
+            # Shared: a publish cannot prune the snapshot while it is being mapped
+            with self.directory.lock(shared=True):
+                name = self.directory.current()
+                if name is not None and name != self.name:
+                    self._attach(store, name, self.version)
+
+    def publish(self, store):
+        """Publish local writes (store changed since it was attached) as a new snapshot."""
+        with self._lock, self.directory.lock():
+            if store.version == self.version:
+                return
+            state = store.state
+            arrays = snapshot_arrays(state) if self.directory.current() == self.name else None
+            if arrays is None:
+                arrays = snapshot_arrays(load_from_db())
+            # A write landing meanwhile keeps the store as it is; the next publish (from the
+            # database, as the store is then behind CURRENT) covers it
+            self._attach(store, self.directory.write(arrays), state.version)
+
+
+def load_from_db():
+    store = HexagonStore()
+    db = SessionLocal()
+    try:
+        store.load(db)
+    finally:
+        db.close()
+    return store
+
+
+snapshot_source = SnapshotSource(SnapshotDirectory(settings.SNAPSHOT_DIR)) if settings.SNAPSHOT_DIR else None
+
+
+class SnapshotMiddleware:
+    """Keeps a worker on the latest shared snapshot (multi-worker mode).
+
+    Before each request the worker attaches to a newer snapshot if there is
+    one, and re-reads the weight profiles file if it changed (e.g. through
+    POST /hexagons/profiles/reload on another worker); a request that changed
+    the store publishes a new snapshot before its response starts, so other
+    workers serve the write once it is acknowledged.
+    """
+
+    def __init__(self, app, store):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if snapshot_source.changed():
+            # Attaching takes the directory lock and maps the snapshot: off the event loop, as publish
+            await run_in_threadpool(snapshot_source.refresh, self.store)
+        weight_profiles.reload_if_changed()
+
+        async def send_after_publish(message):
+            if message["type"] == "http.response.start" and self.store.version != snapshot_source.version:
+                await run_in_threadpool(snapshot_source.publish, self.store)
+            await send(message)
+
+        await self.app(scope, receive, send_after_publish)
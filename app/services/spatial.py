@@ -0,0 +1,159 @@
+import numpy as np
+
+# A polygon spanning more grid cells than this along either axis stays out of the
+# grid, which would list it in every cell it covers, and is tested against every point
+MAX_SPAN_CELLS = 4
+
+
+class HexagonIndex:
+    """Point-in-hexagon lookup over the hexagon polygons (the store peaks).
+
+    Polygon bounding boxes are bucketed into a uniform lon/lat grid sized to
+    the typical hexagon, so a point only gets tested against the few polygons
+    registered in its cell, plus the rare ``oversized`` ones kept apart. Tests
+    are vectorized ray casting, which lets a batch of points be resolved in a
+    handful of array operations.
+    """
+
+    def __init__(self, hex_ids, polygons, version=0):
+        self.hex_ids = hex_ids
+        self.version = version
+        n = len(polygons)
+        size = max((len(polygon) for polygon in polygons), default=0)
+        # Pad every ring to the same length by repeating its last vertex (a zero-length edge)
+        self.vertices = np.zeros((n, max(size, 1), 2), dtype=np.float64)
+        valid = np.zeros(n, dtype=bool)
+        for row, polygon in enumerate(polygons):
+            if len(polygon) >= 3:
+                ring = np.asarray(polygon, dtype=np.float64)[:, :2]
+                self.vertices[row, :len(ring)] = ring
+                self.vertices[row, len(ring):] = ring[-1]
+                valid[row] = True
+
+        rows = np.flatnonzero(valid)
+        self.valid = valid
+        self.min_xy = self.vertices.min(axis=1)
+        self.max_xy = self.vertices.max(axis=1)
+        if not len(rows):
+            self.origin = np.zeros(2)
+            self.cell = np.ones(2)
+            self.cells = np.full((1, 1, 1), -1, dtype=np.int64)
+            self.oversized = np.zeros(0, dtype=np.int64)
+            return
+
+        self.cell = np.median(self.max_xy[rows] - self.min_xy[rows], axis=0)
+        self.cell[self.cell <= 0] = 1.0
+        oversized = ((self.max_xy[rows] - self.min_xy[rows]) / self.cell > MAX_SPAN_CELLS).any(axis=1)
+        self.oversized = rows[oversized]
+        rows = rows[~oversized]
+        self.origin = self.min_xy[rows].min(axis=0)
+        shape = np.floor((self.max_xy[rows].max(axis=0) - self.origin) / self.cell).astype(np.int64) + 1
+
+        buckets = {}
+        lo = np.floor((self.min_xy[rows] - self.origin) / self.cell).astype(np.int64)
+        hi = np.floor((self.max_xy[rows] - self.origin) / self.cell).astype(np.int64)
+        for row, (x0, y0), (x1, y1) in zip(rows.tolist(), lo.tolist(), hi.tolist()):
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    buckets.setdefault((x, y), []).append(row)
+        depth = max(len(bucket) for bucket in buckets.values())
+        self.cells = np.full((shape[0], shape[1], depth), -1, dtype=np.int64)
+        for (x, y), bucket in buckets.items():
+            self.cells[x, y, :len(bucket)] = bucket
+
+    @classmethod
+    def from_store(cls, store):
+        state = store.state
+        return cls(state.hex_ids, state.peaks, state.version)
+
+    # Attributes making up a built index, as saved in a dataset snapshot
+    ARRAYS = ("vertices", "valid", "min_xy", "max_xy", "origin", "cell", "cells", "oversized")
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, hex_ids, arrays, version=0):
+        """Index over already built arrays (see ``arrays``), without rebuilding the grid."""
+        index = cls.__new__(cls)
+        index.hex_ids = hex_ids
+        index.version = version
+        # Snapshots written before oversized polygons were kept apart have none
+        index.oversized = np.zeros(0, dtype=np.int64)
+        for name in cls.ARRAYS:
+            if name in arrays:
+                setattr(index, name, arrays[name])
+        return index
+
+    def candidates(self, lon, lat):
+        """(m, depth + oversized) candidate rows for each point, -1 where there is none."""
+        cell = np.floor((np.stack([lon, lat], axis=1) - self.origin) / self.cell).astype(np.int64)
+        inside = (
+            (cell[:, 0] >= 0) & (cell[:, 0] < self.cells.shape[0])
+            & (cell[:, 1] >= 0) & (cell[:, 1] < self.cells.shape[1])
+        )
+        candidates = np.full((len(lon), self.cells.shape[2]), -1, dtype=np.int64)
+        candidates[inside] = self.cells[cell[inside, 0], cell[inside, 1]]
+        if len(self.oversized):
+            candidates = np.hstack([candidates, np.broadcast_to(self.oversized, (len(lon), len(self.oversized)))])
+        return candidates
+
+    def locate_rows(self, lon, lat):
+        """Row of the hexagon containing each point, -1 where none does."""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        candidates = self.candidates(lon, lat)
+        ring = self.vertices[np.maximum(candidates, 0)]
+        following = np.roll(ring, -1, axis=2)
+        px = lon[:, None, None]
+        py = lat[:, None, None]
+        ax, ay = ring[..., 0], ring[..., 1]
+        bx, by = following[..., 0], following[..., 1]
+        crosses = (ay > py) != (by > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = ax + (py - ay) * (bx - ax) / (by - ay)
+        hits = (crosses & (px < x_cross)).sum(axis=2) % 2 == 1
+        hits &= candidates >= 0
+        first = hits.argmax(axis=1)
+        found = hits[np.arange(len(lon)), first]
+        return np.where(found, candidates[np.arange(len(lon)), first], -1)
+
+    def overlapping(self, min_lon, min_lat, max_lon, max_lat):
+        """Rows, in store order, of hexagons whose polygon bounding box overlaps the box."""
+        lo = np.floor((np.array([min_lon, min_lat]) - self.origin) / self.cell).astype(np.int64)
+        hi = np.floor((np.array([max_lon, max_lat]) - self.origin) / self.cell).astype(np.int64)
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, np.array(self.cells.shape[:2]) - 1)
+        rows = self.oversized
+        if (lo <= hi).all():
+            rows = np.union1d(rows, self.cells[lo[0]:hi[0] + 1, lo[1]:hi[1] + 1])
+            rows = rows[rows >= 0]
+        overlaps = (
+            (self.max_xy[rows, 0] >= min_lon) & (self.min_xy[rows, 0] <= max_lon)
+            & (self.max_xy[rows, 1] >= min_lat) & (self.min_xy[rows, 1] <= max_lat)
+        )
+        return rows[overlaps]
+
+    def locate(self, lon, lat):
+        """hex_ids containing each point, None where no hexagon does."""
+        rows = self.locate_rows(lon, lat)
+        return [int(self.hex_ids[row]) if row >= 0 else None for row in rows.tolist()]
+
+
+_index = None
+
+
+def get_hexagon_index(store):
+    """Index over the current store geometry, rebuilt after any write."""
+    global _index
+    index = _index
+    state = store.state
+    if index is None or index.version != state.version:
+        index = _index = HexagonIndex.from_store(state)
+    return index
+
+
+def set_hexagon_index(index):
+    """Use a ready-made index (matched to the store by ``version``), e.g. from a snapshot."""
+    global _index
+    _index = index
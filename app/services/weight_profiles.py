@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+
+# Persona profile applied on top of the base profile for each add-on flag, in merge order
+ADDON_PROFILES = [
+    ("uses_public_transport_flg", "uses_public_transport"),
+    ("parent_flg", "parent"),
+    ("pet_owner_flg", "pet_owner"),
+    ("big_family_flg", "big_family"),
+    ("old_family_flg", "old_family"),
+]
+REQUIRED_PROFILES = ["default", "builder", "driver", "walker"] + [name for _, name in ADDON_PROFILES]
+
+
+def canonical_flags(builder_flg, driver_flg,
+                    uses_public_transport_flg, parent_flg,
+                    pet_owner_flg, big_family_flg, old_family_flg):
+    """Flags tuple used as memo/cache key; builder_flg overrides every other flag."""
+    if builder_flg:
+        return (True, False, False, False, False, False, False)
+    return (False, bool(driver_flg), bool(uses_public_transport_flg), bool(parent_flg),
+            bool(pet_owner_flg), bool(big_family_flg), bool(old_family_flg))
+
+
+def merge_profiles(rati, profile):
+    """Keep the stronger weight per feature: larger positive, more negative otherwise."""
+    return np.where(rati >= 0, np.maximum(profile, rati), np.minimum(profile, rati))
+
+
+class WeightProfileRegistry:
+    """Persona weight profiles compiled into fixed-size arrays.
+
+    The config file maps profile name to ``{feature name: weight}``; every
+    profile other than ``default`` is layered over ``default``. Merged vectors
+    are memoized per canonical flag combination until the next ``reload``.
+    ``reload_if_changed`` is a single stat when the file is unchanged, so a
+    worker can call it on every request to follow a reload made in another.
+    """
+
+    def __init__(self, features, path):
+        self.features = features
+        self.path = path
+        self.version = 0
+        self.mtime = None
+        self.loaded_at = None
+        self._read_mtime = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def compile(self, config):
+        missing = set(REQUIRED_PROFILES) - set(config)
+        if missing:
+            raise ValueError(f"Missing weight profiles: {', '.join(sorted(missing))}")
+        default = self.vector(config["default"])
+        profiles = {"default": default}
+        for name, weights in config.items():
+            if name != "default":
+                profiles[name] = self.vector(weights, base=default)
+        return profiles
+
+    def vector(self, weights, base=None):
+        """Weight array laid out by feature index from a ``{name: weight}`` mapping."""
+        vector = np.zeros(len(self.features), dtype=np.float64) if base is None else base.copy()
+        for name, weight in weights.items():
+            if name not in self.features.__members__:
+                raise ValueError(f"Unknown feature '{name}'")
+            vector[self.features[name].value] = weight
+        vector.setflags(write=False)
+        return vector
+
+    def reload(self):
+        """Re-read the config file; the previous profiles stay active if it is invalid."""
+        with self._lock:
+            mtime = self._read_mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                profiles = self.compile(json.load(f))
+            # Profiles and their memo are swapped together so no stale merge survives
+            self._state = (profiles, {})
+            self.mtime = mtime
+            self.loaded_at = time.time()
+            self.version += 1
+
+    def reload_if_changed(self):
+        """reload if the file changed since it was last read; an invalid file is not retried until it changes again."""
+        try:
+            if os.path.getmtime(self.path) == self._read_mtime:
+                return False
+            self.reload()
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def weights(self, builder_flg, driver_flg,
+                uses_public_transport_flg, parent_flg,
+                pet_owner_flg, big_family_flg, old_family_flg):
+        flags = canonical_flags(builder_flg, driver_flg,
+                                uses_public_transport_flg, parent_flg,
+                                pet_owner_flg, big_family_flg, old_family_flg)
+        profiles, memo = self._state
+        merged = memo.get(flags)
+        if merged is None:
+            merged = memo[flags] = self._merge(profiles, flags)
+        return merged
+
+    @property
+    def profiles(self):
+        return self._state[0]
+
+    @staticmethod
+    def _merge(profiles, flags):
+        builder_flg, driver_flg = flags[:2]
+        if builder_flg:
+            return profiles["builder"]
+        rati = profiles["driver"] if driver_flg else profiles["walker"]
+        for flag, (_, name) in zip(flags[2:], ADDON_PROFILES):
+            if flag:
+                rati = merge_profiles(rati, profiles[name])
+        rati.setflags(write=False)
+        return rati
@@ -0,0 +1,37 @@
+import os
+
+# Where /hexagons/{id}/metrics reads hexagon data: "store" serves it from the
+# in-memory store and rating cache, "db" loads a rating context from SQLite
+RATING_SOURCE = os.getenv("RATING_SOURCE", "store")
+
+# Persona weight profiles, reloadable through POST /hexagons/profiles/reload
+WEIGHT_PROFILES_PATH = os.getenv(
+    "WEIGHT_PROFILES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "services", "weight_profiles.json"),
+)
+
+# Data access used by the hexagon record endpoints (get, metrics, writes):
+# "sync" runs them on the threadpool over a blocking Session, "async" runs them
+# on the event loop over an AsyncSession (aiosqlite)
+DB_MODE = os.getenv("DB_MODE", "sync")
+
+# SQLite connection profile (see database.database.DB_PROFILES): "read" for
+# read-heavy serving, "write" for bulk loads and write-heavy workloads
+DB_PROFILE = os.getenv("DB_PROFILE", "read")
+
+# Request profiling (X-Profile-Token header, results under /admin/profiles) is
+# off unless a token is configured; PROFILE_BUFFER_SIZE profiles are kept
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "32"))
+
+# Multi-worker serving: with SNAPSHOT_DIR set, workers serve the hexagon data
+# from a shared memory-mapped snapshot kept there (see services.snapshot)
+# instead of each loading the table; `python main.py` starts WORKERS of them
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Identical concurrent GET /hexagons/{id}/metrics requests share one computation
+# (see services.single_flight), whose result is kept METRICS_CACHE_TTL seconds
+# (0 keeps nothing) for at most METRICS_CACHE_SIZE keys
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "2.0"))
+METRICS_CACHE_SIZE = int(os.getenv("METRICS_CACHE_SIZE", "10000"))
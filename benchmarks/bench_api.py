@@ -0,0 +1,147 @@
+import asyncio
+import json
+import random
+import time
+from common import summarize
+
+CONCURRENCY = (1, 8, 32)
+
+
+async def asgi_request(app, method, path, query="", body=None):
+    """Send one request straight into the ASGI app, returning (status, body)."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"), (b"accept-encoding", b"br, gzip")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    payload = b"" if body is None else json.dumps(body).encode()
+    done = asyncio.Event()
+    received = False
+    response = {"status": None, "body": []}
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        # Streaming responses listen for a disconnect; only send it once the response is out
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    await app(scope, receive, send)
+    return response["status"], b"".join(response["body"])
+
+
+async def load(app, request, total, concurrency):
+    """Run ``total`` requests with at most ``concurrency`` in flight; per-request latencies and wall time."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            status, _ = await asgi_request(app, *request(i))
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies, time.perf_counter() - start, failures
+
+
+def scenarios(store):
+    """name -> request(i) giving (method, path, query, body) of the i-th request."""
+    rng = random.Random(0)
+    hex_ids = store.hex_ids.tolist()
+    ids = [rng.choice(hex_ids) for _ in range(1000)]
+    lons = store.columns["center_lon"]
+    lats = store.columns["center_lat"]
+    min_lon, max_lon, min_lat, max_lat = lons.min(), lons.max(), lats.min(), lats.max()
+    # A viewport a tenth of the city wide, around the middle
+    mid_lon, mid_lat = (min_lon + max_lon) / 2, (min_lat + max_lat) / 2
+    half_lon, half_lat = (max_lon - min_lon) / 20, (max_lat - min_lat) / 20
+    bbox = f"{mid_lon - half_lon},{mid_lat - half_lat},{mid_lon + half_lon},{mid_lat + half_lat}"
+    # Hexagon centres, so every point resolves
+    points = [[store.get(i)["center_lon"], store.get(i)["center_lat"]] for i in ids]
+    flag_names = ("builder_flg", "driver_flg", "uses_public_transport_flg", "parent_flg",
+                  "pet_owner_flg", "big_family_flg", "old_family_flg")
+
+    def flags(i):
+        return "&".join(f"{name}={'true' if i >> bit & 1 else 'false'}" for bit, name in enumerate(flag_names))
+
+    def persona(i):
+        return {name: bool(i >> bit & 1) for bit, name in enumerate(flag_names)}
+
+    # The comparison screen: 30 hexagons under 4 personas
+    def batch(i):
+        return {"hex_ids": [ids[(i + k) % len(ids)] for k in range(30)], "flags": [persona(i + k) for k in range(4)]}
+
+    return {
+        "list": lambda i: ("GET", "/hexagons/", "limit=100"),
+        "list.summary": lambda i: ("GET", "/hexagons/", "limit=100&view=summary"),
+        "export": lambda i: ("GET", "/hexagons/export", ""),
+        "grid": lambda i: ("GET", "/hexagons/grid", ""),
+        "grid.binary": lambda i: ("GET", "/hexagons/grid", "format=binary"),
+        "read": lambda i: ("GET", f"/hexagons/{ids[i % len(ids)]}", ""),
+        "metrics": lambda i: ("GET", f"/hexagons/{ids[i % len(ids)]}/metrics", flags(i)),
+        "metrics.rings=3": lambda i: ("GET", f"/hexagons/{ids[i % len(ids)]}/metrics", flags(i) + "&rings=3"),
+        "metrics.batch": lambda i: ("POST", "/hexagons/metrics:batch", "", batch(i)),
+        "ratings": lambda i: ("GET", "/hexagons/ratings", flags(i)),
+        "ratings.post": lambda i: ("POST", "/hexagons/ratings", "", {"weights": {"PARK": 1.0 + i % 5}}),
+        "top": lambda i: ("GET", "/hexagons/top", flags(i) + "&k=20"),
+        "viewport": lambda i: ("GET", "/hexagons/viewport", f"bbox={bbox}"),
+        "lod": lambda i: ("GET", "/hexagons/lod", flags(i)),
+        "lod.viewport": lambda i: ("GET", "/hexagons/lod", f"bbox={bbox}&zoom=12&" + flags(i)),
+        "locate": lambda i: ("GET", "/hexagons/locate", f"lon={points[i % 1000][0]}&lat={points[i % 1000][1]}"),
+        "locate.batch": lambda i: ("POST", "/hexagons/locate", "", {"points": points}),
+        "patch": lambda i: ("PATCH", f"/hexagons/{ids[i % len(ids)]}", "", {"count_parks": i % 3}),
+    }
+
+
+async def run_all(app, store, quick):
+    results = {}
+    total = 40 if quick else 400
+    for name, request in scenarios(store).items():
+        for concurrency in CONCURRENCY:
+            # Untimed warmup (caches, pools, lazy indexes)
+            await load(app, request, concurrency, concurrency)
+            latencies, wall, failures = await load(app, request, total, concurrency)
+            results[f"api.{name}.c={concurrency}"] = summarize(
+                latencies, rps=total / wall, failures=failures,
+            )
+    return results
+
+
+def run(quick=False):
+    """Every endpoint at each CONCURRENCY level, in process through the ASGI interface."""
+    from main import app
+    from services.hexagon_store import hexagon_store
+
+    async def main():
+        await app.router.startup()
+        try:
+            return await run_all(app, hexagon_store, quick)
+        finally:
+            await app.router.shutdown()
+
+    return asyncio.run(main())
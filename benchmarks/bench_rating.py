@@ -0,0 +1,40 @@
+import random
+from common import measure, summarize
+
+
+def run(quick=False):
+    """calc_rating / calc_finaly_rating per flag combination, plus whole-grid engine ratings."""
+    from database.database import SessionLocal
+    from services.hexagon_ratings import calc_finaly_rating, calc_rating, store_rating_context
+    from services.hexagon_store import HexagonStore
+    from services.rating_cache import REACHABLE_FLAGS
+    from services.rating_engine import RatingEngine
+
+    store = HexagonStore()
+    db = SessionLocal()
+    try:
+        store.load(db)
+    finally:
+        db.close()
+    sample = random.Random(0).sample(store.hex_ids.tolist(), 20 if quick else 100)
+    contexts = [store_rating_context(store, hex_id) for hex_id in sample]
+    repeat = 3 if quick else 10
+    combos = REACHABLE_FLAGS[::8] if quick else REACHABLE_FLAGS
+
+    results = {}
+    for flags in combos:
+        key = "".join("1" if flag else "0" for flag in flags)
+        # Per-call time: each sample covers every sampled hexagon once
+        samples = measure(lambda: [calc_rating(context.values, *flags) for context in contexts], repeat)
+        results[f"micro.calc_rating.flags={key}"] = summarize([s / len(contexts) for s in samples])
+        samples = measure(lambda: [calc_finaly_rating(context, *flags) for context in contexts], repeat)
+        results[f"micro.calc_finaly_rating.flags={key}"] = summarize([s / len(contexts) for s in samples])
+
+    results["micro.engine.build"] = summarize(measure(lambda: RatingEngine.from_store(store), repeat))
+    engine = RatingEngine.from_store(store)
+    flags = REACHABLE_FLAGS[-1]
+    results["micro.engine.rate_flags"] = summarize(measure(lambda: engine.rate_flags(*flags), repeat * 10))
+    results["micro.engine.rate_flags.rings=3"] = summarize(
+        measure(lambda: engine.rate_flags(*flags, rings=3, decay=0.5), repeat * 10)
+    )
+    return results
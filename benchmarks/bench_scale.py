@@ -0,0 +1,132 @@
+import math
+import os
+import random
+import shutil
+import sqlite3
+from common import measure, summarize
+
+FACTORS = (10, 100)
+
+
+def enlarge(source, target, factor):
+    """Write hexagonal_data of source, tiled ``factor`` times, to target.
+
+    Copies are laid out side by side on a grid next to the original city,
+    with hex_ids and neighbour lists offset per copy, so every copy is a
+    complete, self-contained neighbourhood graph of its own.
+    """
+    from models import codec
+
+    shutil.copy(source, target)
+    connection = sqlite3.connect(target)
+    try:
+        names = [row[1] for row in connection.execute("PRAGMA table_info(hexagonal_data)")]
+        rows = connection.execute(f"SELECT {', '.join(names)} FROM hexagonal_data ORDER BY hex_id").fetchall()
+        column = {name: i for i, name in enumerate(names)}
+        min_lon, max_lon, min_lat, max_lat, span = connection.execute(
+            "SELECT min(center_lon), max(center_lon), min(center_lat), max(center_lat), max(hex_id) FROM hexagonal_data"
+        ).fetchone()
+        # A margin of 10% keeps the copies' polygons apart
+        dx, dy = (max_lon - min_lon) * 1.1, (max_lat - min_lat) * 1.1
+        side = math.ceil(math.sqrt(factor))
+        insert = f"INSERT INTO hexagonal_data ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+        for copy in range(1, factor):
+            shift = (copy % side * dx, copy // side * dy)
+            copied = []
+            for row in rows:
+                row = list(row)
+                row[column["hex_id"]] += copy * span
+                row[column["center_lon"]] += shift[0]
+                row[column["center_lat"]] += shift[1]
+                if row[column["peaks"]] is not None:
+                    row[column["peaks"]] = codec.pack_peaks(codec.unpack_peaks(row[column["peaks"]]) + shift)
+                if row[column["neighbour_ids"]] is not None:
+                    row[column["neighbour_ids"]] = codec.pack_ids(codec.unpack_ids(row[column["neighbour_ids"]]) + copy * span)
+                copied.append(row)
+            connection.executemany(insert, copied)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def scale_results(path, factor, quick):
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from database.database import configure_connection
+    from services.hexagon_ratings import calc_finaly_rating, load_rating_context, store_rating_context
+    from services.hexagon_store import HexagonStore
+    from services.rating_cache import REACHABLE_FLAGS
+    from services.rating_engine import RatingEngine, top_k
+    from services.spatial import HexagonIndex
+
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", configure_connection)
+    Session = sessionmaker(bind=engine)
+    prefix = f"scale.x{factor}"
+    repeat = 3 if quick else 5
+    flags = REACHABLE_FLAGS[-1]
+    results = {}
+    try:
+        def load():
+            with Session() as db:
+                store = HexagonStore()
+                store.load(db)
+            return store
+
+        results[f"{prefix}.store.load"] = summarize(measure(load, repeat, warmup=0))
+        store = load()
+        results[f"{prefix}.engine.build"] = summarize(measure(lambda: RatingEngine.from_store(store), repeat))
+        rating_engine = RatingEngine.from_store(store)
+        results[f"{prefix}.engine.rate_flags"] = summarize(measure(lambda: rating_engine.rate_flags(*flags), repeat))
+        results[f"{prefix}.engine.rate_flags.rings=3"] = summarize(
+            measure(lambda: rating_engine.rate_flags(*flags, rings=3, decay=0.5), repeat)
+        )
+        ratings = rating_engine.rate_flags(*flags)
+        results[f"{prefix}.top_k"] = summarize(measure(lambda: top_k(ratings, 20), repeat * 10))
+        results[f"{prefix}.index.build"] = summarize(measure(lambda: HexagonIndex.from_store(store), repeat))
+        index = HexagonIndex.from_store(store)
+
+        rng = random.Random(0)
+        lons, lats = store.columns["center_lon"], store.columns["center_lat"]
+        points = [(rng.uniform(lons.min(), lons.max()), rng.uniform(lats.min(), lats.max())) for _ in range(1000)]
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        results[f"{prefix}.index.locate_1000"] = summarize(measure(lambda: index.locate(xs, ys), repeat))
+        # One original city's extent, wherever it is on the grid
+        width = (lons.max() - lons.min()) / math.ceil(math.sqrt(factor))
+        height = (lats.max() - lats.min()) / math.ceil(math.sqrt(factor))
+        bbox = (lons.min(), lats.min(), lons.min() + width, lats.min() + height)
+        results[f"{prefix}.index.overlapping"] = summarize(measure(lambda: index.overlapping(*bbox), repeat * 10))
+        results[f"{prefix}.store.page_after"] = summarize(
+            measure(lambda: store.page_after(int(store.hex_ids[len(store) // 2]), 100), repeat * 10)
+        )
+
+        ids = [rng.choice(store.hex_ids.tolist()) for _ in range(100)]
+        results[f"{prefix}.rating.store"] = summarize(
+            [s / len(ids) for s in measure(lambda: [calc_finaly_rating(store_rating_context(store, i), *flags) for i in ids], repeat)]
+        )
+        with Session() as db:
+            results[f"{prefix}.rating.db"] = summarize(
+                [s / len(ids) for s in measure(lambda: [calc_finaly_rating(load_rating_context(db, i), *flags) for i in ids], repeat)]
+            )
+    finally:
+        engine.dispose()
+    return results
+
+
+def run(quick=False):
+    """Store, engine, spatial index and single ratings over hexagonal_data enlarged FACTORS times."""
+    from database.database import engine
+
+    # Closing the pool checkpoints the WAL, so the file copied below is complete
+    engine.dispose()
+    source = os.path.abspath(engine.url.database)
+    results = {}
+    for factor in FACTORS[:1] if quick else FACTORS:
+        target = os.path.join(os.path.dirname(source), f"scale_x{factor}.db")
+        enlarge(source, target, factor)
+        with sqlite3.connect(target) as connection:
+            rows = connection.execute("SELECT count(*) FROM hexagonal_data").fetchone()[0]
+        results.update(scale_results(target, factor, quick))
+        results[f"scale.x{factor}.rows"] = {"unit": "rows", "median": rows}
+        os.remove(target)
+    return results
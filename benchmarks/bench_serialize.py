@@ -0,0 +1,80 @@
+import asyncio
+from typing import Dict, List
+from common import measure, summarize
+
+PAGE_SIZES = (100, 1000, None)
+
+
+def run(quick=False):
+    """Read responses rendered the validated way (response_model + jsonable_encoder) and through fast_json.
+
+    Both renderings of every case are compared byte for byte first; a
+    mismatch fails the run instead of timing it.
+    """
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    from pydantic import BaseModel
+    import schemas
+    from database.database import SessionLocal
+    from services.fast_json import FastJSONResponse, float_list, store_rows
+    from services.hexagon_store import HexagonStore
+    from services.rating_engine import RatingEngine
+
+    store = HexagonStore()
+    db = SessionLocal()
+    try:
+        store.load(db)
+    finally:
+        db.close()
+    loop = asyncio.new_event_loop()
+
+    def validated(type_, content):
+        field = create_response_field(name="Response", type_=type_)
+        return JSONResponse(loop.run_until_complete(
+            serialize_response(field=field, response_content=content, is_coroutine=True)
+        )).body
+
+    def page_case(limit, fields):
+        rows = store.page_rows(0, limit or len(store))
+        if fields is None:
+            return (
+                lambda: validated(List[schemas.Hexagon], [store.row(row) for row in rows.tolist()]),
+                lambda: FastJSONResponse(store_rows(store, rows)).body,
+            )
+        # Projections were validated by hand before the response_model check
+        model = schemas.hexagon_projection(fields)
+        return (
+            lambda: JSONResponse([model(**store.row(row, fields)).dict() for row in rows.tolist()]).body,
+            lambda: FastJSONResponse(store_rows(store, rows, fields)).body,
+        )
+
+    class Ratings(BaseModel):
+        ratings: Dict[int, float]
+
+    engine = RatingEngine.from_store(store)
+    ratings = engine.rate_flags(True, True, False, True, False, False, True)
+    cases = {
+        f"{view}.limit={limit or 'all'}": page_case(limit, fields)
+        for limit in PAGE_SIZES
+        for view, fields in (("full", None), ("summary", schemas.HEXAGON_VIEWS["summary"]),
+                             ("fields=2", ("center_lon", "center_lat")))
+    }
+    cases["ratings"] = (
+        lambda: validated(Ratings, {"ratings": dict(zip(engine.hex_ids.tolist(), ratings.tolist()))}),
+        lambda: FastJSONResponse({"ratings": dict(zip(engine.hex_ids.tolist(), float_list(ratings)))}).body,
+    )
+
+    repeat = 3 if quick else 10
+    results = {}
+    try:
+        for name, (slow, fast) in cases.items():
+            if slow() != fast():
+                raise AssertionError(f"serialize.{name}: fast path output differs from the validated one")
+            before = summarize(measure(slow, repeat))
+            after = summarize(measure(fast, repeat))
+            results[f"serialize.{name}.validated"] = before
+            results[f"serialize.{name}.fast"] = {**after, "speedup": before["median"] / after["median"]}
+    finally:
+        loop.close()
+    return results
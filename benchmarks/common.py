@@ -0,0 +1,56 @@
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "app")
+DB_NAME = "moscow_urban_analysis_final.db"
+
+
+def prepare_workdir():
+    """Copy the shipped database into a temp dir and make it the working directory.
+
+    The app opens ``./moscow_urban_analysis_final.db``, so benchmarks (which
+    also write) never touch the real file. Must run before the first connection.
+    """
+    work = tempfile.mkdtemp(prefix="hexbench-")
+    shutil.copy(os.path.join(APP_DIR, DB_NAME), os.path.join(work, DB_NAME))
+    os.chdir(work)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    return work
+
+
+def percentile(sorted_samples, q):
+    index = min(len(sorted_samples) - 1, max(0, round(q * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples, **extra):
+    """Timing statistics in seconds for a list of samples."""
+    ordered = sorted(samples)
+    return {
+        "unit": "s",
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "median": statistics.median(ordered),
+        "p95": percentile(ordered, 0.95),
+        "p99": percentile(ordered, 0.99),
+        "min": ordered[0],
+        **extra,
+    }
+
+
+def measure(func, repeat, warmup=1):
+    """Duration of ``repeat`` calls of func, after ``warmup`` untimed ones."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
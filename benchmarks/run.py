@@ -0,0 +1,127 @@
+"""Benchmark suite for the API and the rating code.
+
+Runs entirely in process against a temporary copy of the database (no
+network, the shipped .db files are never written). Results go to a JSON file
+that a later run can be compared against with --baseline:
+
+    python benchmarks/run.py --output benchmarks/results/before.json
+    python benchmarks/run.py --baseline benchmarks/results/before.json
+
+Suites: ``micro`` (calc_rating / calc_finaly_rating per flag combination and
+the rating engine), ``api`` (every endpoint at several concurrency levels),
+``scale`` (hexagonal_data enlarged 10x and 100x) and ``serialize`` (read
+responses rendered with and without per-row validation). Settings such as
+DB_MODE and RATING_SOURCE are read from the environment as usual.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+from common import ROOT, prepare_workdir
+
+SUITES = ("micro", "api", "scale", "serialize")
+
+
+def metadata(args):
+    import numpy
+    import settings
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "suites": args.suite,
+        "quick": args.quick,
+        "settings": {
+            "DB_MODE": settings.DB_MODE,
+            "DB_PROFILE": settings.DB_PROFILE,
+            "RATING_SOURCE": settings.RATING_SOURCE,
+        },
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print each timing next to its baseline median; returns the names that got slower than threshold."""
+    regressions = []
+    print(f"{'benchmark':60} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None or result.get("unit") != "s" or not before.get("median"):
+            continue
+        change = result["median"] / before["median"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:60} {before['median'] * 1000:10.3f}ms {result['median'] * 1000:10.3f}ms {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suite", action="append", choices=SUITES,
+                        help="suite to run, repeatable (default: all)")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, 10x scale only")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="results file to compare the median timings against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown reported as a regression (default: 0.2)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on any regression")
+    args = parser.parse_args()
+    args.suite = args.suite or list(SUITES)
+
+    output = os.path.abspath(args.output) if args.output else os.path.join(
+        ROOT, "benchmarks", "results", datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json",
+    )
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    work = prepare_workdir()
+    try:
+        from database.database import engine
+        from database.migrations import migrate
+        migrate(engine)
+
+        import bench_api
+        import bench_rating
+        import bench_scale
+        import bench_serialize
+        modules = {"micro": bench_rating, "api": bench_api, "scale": bench_scale, "serialize": bench_serialize}
+        results = {}
+        for suite in args.suite:
+            print(f"running {suite}...", file=sys.stderr)
+            results.update(modules[suite].run(quick=args.quick))
+        report = {"meta": metadata(args), "results": results}
+        engine.dispose()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"results written to {output}", file=sys.stderr)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()